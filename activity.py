@@ -0,0 +1,164 @@
+"""
+Time-windowed activity counters for CrushBot
+"""
+import heapq
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+
+class Ring:
+    """Fixed number of consecutive time buckets, the newest last.
+    
+    Buckets are rotated lazily: add() and total() first zero the buckets
+    that elapsed since the last call, which touches at most every bucket
+    once, so both are O(1) in the number of events.
+    """
+    
+    __slots__ = ("unit", "counts", "last")
+    
+    def __init__(self, unit: int, size: int):
+        self.unit = unit
+        self.counts = array("I", bytes(4 * size))
+        # Index (time // unit) of the newest bucket
+        self.last = 0
+    
+    def _advance(self, now: float) -> int:
+        index = int(now // self.unit)
+        elapsed = index - self.last
+        if elapsed > 0:
+            size = len(self.counts)
+            for step in range(1, min(elapsed, size) + 1):
+                self.counts[(self.last + step) % size] = 0
+            self.last = index
+        return index
+    
+    def add(self, now: float, count: int = 1):
+        index = self._advance(now)
+        self.counts[index % len(self.counts)] += count
+    
+    def total(self, now: float, buckets: int = None) -> int:
+        """Sum of the newest buckets (all of them by default)"""
+        index = self._advance(now)
+        size = len(self.counts)
+        buckets = size if buckets is None else min(buckets, size)
+        return sum(self.counts[(index - back) % size] for back in range(buckets))
+    
+    def series(self, now: float) -> List[Tuple[int, int]]:
+        """(bucket start time, count) pairs, oldest first"""
+        index = self._advance(now)
+        size = len(self.counts)
+        return [((index - back) * self.unit, self.counts[(index - back) % size]) for back in range(size - 1, -1, -1)]
+
+
+class _Tally:
+    """Counters for one sender or group in a single array: 24 hourly
+    buckets (the rolling day) followed by 7 daily buckets (the week)"""
+    
+    __slots__ = ("label", "counts", "hour")
+    
+    def __init__(self, label: str):
+        self.label = label
+        self.counts = array("I", bytes(4 * 31))
+        # Index (time // HOUR) of the newest hourly bucket
+        self.hour = 0
+    
+    def advance(self, now: float):
+        """Zero the buckets that elapsed since the last update"""
+        hour = int(now // HOUR)
+        if hour == self.hour:
+            return
+        counts = self.counts
+        for step in range(1, min(hour - self.hour, 24) + 1):
+            counts[(self.hour + step) % 24] = 0
+        day, last_day = hour // 24, self.hour // 24
+        for step in range(1, min(day - last_day, 7) + 1):
+            counts[24 + (last_day + step) % 7] = 0
+        self.hour = hour
+    
+    def add(self, now: float):
+        self.advance(now)
+        self.counts[self.hour % 24] += 1
+        self.counts[24 + self.hour // 24 % 7] += 1
+    
+    def total(self, now: float, period: str) -> int:
+        self.advance(now)
+        return sum(self.counts[:24]) if period == "day" else sum(self.counts[24:])
+
+
+class ActivityTracker:
+    """Per-sender and per-group message counts for /report.
+    
+    Each tracked sender or group costs one array of 31 32-bit counters
+    (24 hourly and 7 daily buckets). Both maps are LRU-bounded, so the
+    least recently active keys are forgotten first once the limits are
+    reached. Overall traffic additionally keeps per-minute buckets for the
+    last hour and per-hour buckets for the last week, for peak hours.
+    Nothing is persisted: counts start from zero after a restart.
+    """
+    
+    def __init__(self, max_senders: int = None, max_groups: int = None):
+        self.max_senders = max_senders or Config.ACTIVITY_MAX_SENDERS
+        self.max_groups = max_groups or Config.ACTIVITY_MAX_GROUPS
+        self._senders: "OrderedDict[int, _Tally]" = OrderedDict()
+        self._groups: "OrderedDict[int, _Tally]" = OrderedDict()
+        self._minutes: Dict[str, Ring] = {kind: Ring(MINUTE, 60) for kind in ("dm", "group")}
+        self._hours: Dict[str, Ring] = {kind: Ring(HOUR, 24 * 7) for kind in ("dm", "group")}
+    
+    @staticmethod
+    def _tally(table: "OrderedDict[int, _Tally]", key: int, label: str, limit: int) -> _Tally:
+        tally = table.get(key)
+        if tally is None:
+            if len(table) >= limit:
+                table.popitem(last=False)
+            tally = table[key] = _Tally(label)
+        else:
+            tally.label = label
+            table.move_to_end(key)
+        return tally
+    
+    def record(self, kind: str, sender_id: Optional[int], sender_label: str,
+               chat_id: int = None, chat_label: str = None):
+        """Count one "dm" or "group" message"""
+        now = time.time()
+        self._minutes[kind].add(now)
+        self._hours[kind].add(now)
+        if sender_id is not None:
+            self._tally(self._senders, sender_id, sender_label, self.max_senders).add(now)
+        if chat_id is not None:
+            self._tally(self._groups, chat_id, chat_label, self.max_groups).add(now)
+    
+    @staticmethod
+    def _top(table: "OrderedDict[int, _Tally]", period: str, now: float, limit: int) -> List[Tuple[int, str, int]]:
+        """(ID, label, count) of the busiest keys in a period"""
+        counts = ((key, tally.label, tally.total(now, period)) for key, tally in table.items())
+        return [row for row in heapq.nlargest(limit, counts, key=lambda row: row[2]) if row[2]]
+    
+    def report(self, period: str = "day", limit: int = None) -> Dict[str, object]:
+        """Totals, top senders and groups and peak hours for "day" (24h) or "week" (7 days)"""
+        limit = limit or Config.REPORT_TOP_N
+        now = time.time()
+        hours = 24 if period == "day" else 24 * 7
+        by_hour = [0] * 24
+        for kind_hours in self._hours.values():
+            for start, count in kind_hours.series(now)[-hours:]:
+                by_hour[time.localtime(start).tm_hour] += count
+        return {
+            "totals": {kind: ring.total(now, hours) for kind, ring in self._hours.items()},
+            "last_hour": sum(ring.total(now) for ring in self._minutes.values()),
+            "senders": self._top(self._senders, period, now, limit),
+            "groups": self._top(self._groups, period, now, limit),
+            "peak_hours": [
+                (hour, count) for hour, count in sorted(enumerate(by_hour), key=lambda item: -item[1])[:3] if count
+            ],
+        }
+    
+    def __len__(self) -> int:
+        return len(self._senders) + len(self._groups)
@@ -0,0 +1,201 @@
+"""
+Local message archive for CrushBot (SQLite, WAL mode, full-text search)
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
+
+from pyrogram.types import Message
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    date INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    chat_title TEXT,
+    message_id INTEGER NOT NULL,
+    sender_id INTEGER,
+    sender_username TEXT,
+    sender_name TEXT,
+    media TEXT,
+    text TEXT,
+    tenant TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages(sender_id, date);
+CREATE INDEX IF NOT EXISTS idx_messages_username ON messages(sender_username COLLATE NOCASE, date);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, date);
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, content='messages', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+INSERT_SQL = (
+    "INSERT INTO messages (date, kind, chat_id, chat_title, message_id, sender_id, "
+    "sender_username, sender_name, media, text, tenant) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+RESULT_COLUMNS = "m.date, m.kind, m.chat_id, m.chat_title, m.sender_id, m.sender_username, m.sender_name, m.media, m.text"
+
+Row = Tuple
+
+
+class MessageArchive:
+    """Record processed messages in SQLite and answer searches from it.
+    
+    record() only appends to an in-memory batch. A background task hands
+    batches to a single dedicated thread that owns the connection, so the
+    event loop never touches the database directly. Rows carry the name of
+    the tenant that recorded them and queries only see their own tenant.
+    """
+    
+    def __init__(self, path: str = None, batch_size: int = None, flush_interval: float = None):
+        self.path = path or Config.ARCHIVE_FILE
+        self.batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.ARCHIVE_FLUSH_INTERVAL
+        self.has_fts = False
+        self._pending: List[Row] = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """Open the database and start the background writer"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._open)
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._writer())
+        logger.info("Message archive ready at %s (full-text search: %s)", self.path, self.has_fts)
+    
+    def _open(self):
+        """Create the connection and schema (runs on the archive thread)"""
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        # Archives created before multi-tenant hosting lack the tenant column
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        if "tenant" not in columns:
+            conn.execute("ALTER TABLE messages ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+        try:
+            conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning("SQLite FTS5 unavailable, falling back to LIKE search: %s", e)
+        conn.commit()
+        self._conn = conn
+    
+    def record(self, message: Message, kind: str, tenant: str = ""):
+        """Queue a message for archiving"""
+        sender = message.from_user
+        self._pending.append((
+            int(message.date.timestamp()) if message.date else int(time.time()),
+            kind,
+            message.chat.id,
+            message.chat.title,
+            message.id,
+            sender.id if sender else None,
+            sender.username if sender else None,
+            " ".join(filter(None, (sender.first_name, sender.last_name))) if sender else None,
+            message.media.value if message.media else None,
+            message.text or message.caption or "",
+            tenant,
+        ))
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def _writer(self):
+        """Flush pending rows every interval, or sooner when a batch fills up"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    async def flush(self):
+        """Write all pending rows in one transaction"""
+        if not self._pending or self._conn is None:
+            return
+        rows, self._pending = self._pending, []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._insert, rows)
+        except Exception as e:
+            logger.error("Error archiving %s messages: %s", len(rows), e)
+    
+    def _insert(self, rows: List[Row]):
+        """Insert a batch of rows (runs on the archive thread)"""
+        with self._conn:
+            self._conn.executemany(INSERT_SQL, rows)
+    
+    def _query(self, sql: str, params: tuple) -> List[Row]:
+        """Run a read query (runs on the archive thread)"""
+        return self._conn.execute(sql, params).fetchall()
+    
+    async def search(self, query: str, tenant: str = "", limit: int = 20) -> List[Row]:
+        """Full-text search over archived message text, newest first"""
+        if self.has_fts:
+            # Quote every term so user input is never parsed as FTS syntax
+            match = " ".join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+            sql = (
+                f"SELECT {RESULT_COLUMNS} FROM messages_fts f JOIN messages m ON m.id = f.rowid "
+                f"WHERE messages_fts MATCH ? AND m.tenant = ? ORDER BY m.date DESC LIMIT ?"
+            )
+            params = (match, tenant, limit)
+        else:
+            sql = (
+                f"SELECT {RESULT_COLUMNS} FROM messages m WHERE m.text LIKE ? AND m.tenant = ? "
+                f"ORDER BY m.date DESC LIMIT ?"
+            )
+            params = (f"%{query}%", tenant, limit)
+        return await self._run_query(sql, params)
+    
+    async def history(self, user: Union[int, str], tenant: str = "", limit: int = 20) -> List[Row]:
+        """Latest archived messages from a user ID or @username"""
+        if isinstance(user, int):
+            sql = (
+                f"SELECT {RESULT_COLUMNS} FROM messages m WHERE m.sender_id = ? AND m.tenant = ? "
+                f"ORDER BY m.date DESC LIMIT ?"
+            )
+        else:
+            user = user.lstrip("@")
+            sql = (
+                f"SELECT {RESULT_COLUMNS} FROM messages m WHERE m.sender_username = ? COLLATE NOCASE "
+                f"AND m.tenant = ? ORDER BY m.date DESC LIMIT ?"
+            )
+        return await self._run_query(sql, (user, tenant, limit))
+    
+    async def _run_query(self, sql: str, params: tuple) -> List[Row]:
+        """Flush pending rows, then run a query on the archive thread"""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._query, sql, params)
+    
+    async def close(self):
+        """Stop the writer, flush what is left and close the database"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._conn is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
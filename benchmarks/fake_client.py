@@ -0,0 +1,175 @@
+"""
+In-process stand-in for pyrogram.Client used by the benchmarks
+
+It registers handlers the same way Pyrogram does, dispatches synthetic
+Message objects through the real filters, and answers API calls after a
+configurable latency, optionally raising FloodWait.
+"""
+import asyncio
+import random
+from collections import Counter
+from datetime import datetime
+from typing import List, Optional
+
+from pyrogram import enums
+from pyrogram.errors import FloodWait
+from pyrogram.types import Chat, Message, MessageEntity, User
+from pyrogram.types.messages_and_media.message import Str
+
+from formatting import utf16_len
+
+BOT_ID = 1000
+BOT_USERNAME = "crushbot"
+
+
+class FakeClient:
+    """Minimal pyrogram.Client replacement for offline load tests"""
+    
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 floodwait_rate: float = 0.0, floodwait_seconds: int = 1, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.floodwait_rate = floodwait_rate
+        self.floodwait_seconds = floodwait_seconds
+        self.random = random.Random(seed)
+        self.me = User(id=BOT_ID, is_bot=True, first_name="CrushBot", username=BOT_USERNAME)
+        self.handlers = []
+        self.calls = Counter()
+        self.floodwaits = 0
+        self._next_id = 1
+    
+    # Handler registration, as used by CrushBot._register_handlers
+    
+    def on_message(self, filters=None, group: int = 0):
+        def decorator(func):
+            self.handlers.append((filters, func))
+            return func
+        return decorator
+    
+    async def dispatch(self, message: Message) -> bool:
+        """Run the first handler whose filter accepts the message, like Pyrogram's dispatcher"""
+        for flt, callback in self.handlers:
+            if flt is None or await flt(self, message):
+                await callback(self, message)
+                return True
+        return False
+    
+    # Lifecycle
+    
+    async def start(self):
+        return self
+    
+    async def stop(self):
+        return self
+    
+    # API surface
+    
+    async def _api(self, method: str):
+        """Account for an API call, wait out its latency and maybe flood-wait"""
+        self.calls[method] += 1
+        delay = self.latency + (self.random.random() * self.jitter if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.floodwait_rate and self.random.random() < self.floodwait_rate:
+            self.floodwaits += 1
+            raise FloodWait(value=self.floodwait_seconds)
+    
+    def _sent(self, chat_id: int) -> Message:
+        self._next_id += 1
+        return Message(id=self._next_id, chat=Chat(id=chat_id, type=enums.ChatType.PRIVATE), date=datetime.now())
+    
+    async def get_me(self) -> User:
+        await self._api("get_me")
+        return self.me
+    
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> Message:
+        await self._api("send_message")
+        return self._sent(chat_id)
+    
+    async def forward_messages(self, chat_id: int, from_chat_id: int, message_ids, **kwargs):
+        await self._api("forward_messages")
+        if isinstance(message_ids, int):
+            return self._sent(chat_id)
+        return [self._sent(chat_id) for _ in message_ids]
+    
+    async def copy_message(self, chat_id: int, from_chat_id: int, message_id: int, **kwargs) -> Message:
+        await self._api("copy_message")
+        return self._sent(chat_id)
+    
+    async def send_cached_media(self, chat_id: int, file_id: str, **kwargs) -> Message:
+        await self._api("send_cached_media")
+        return self._sent(chat_id)
+    
+    async def get_users(self, user_ids):
+        await self._api("get_users")
+        if isinstance(user_ids, (list, tuple, set)):
+            return [User(id=user_id, first_name=f"user{user_id}") for user_id in user_ids]
+        return User(id=user_ids, first_name=f"user{user_ids}")
+    
+    async def get_chat(self, chat_id: int) -> Chat:
+        await self._api("get_chat")
+        return Chat(id=chat_id, type=enums.ChatType.SUPERGROUP, title=f"group{chat_id}")
+    
+    def outbound_calls(self) -> int:
+        """API calls made on behalf of handlers (identity lookups excluded)"""
+        return sum(count for method, count in self.calls.items() if method != "get_me")
+
+
+class MessageFactory:
+    """Build synthetic Message objects that look like parsed updates"""
+    
+    def __init__(self, owner_id: int):
+        self.owner_id = owner_id
+        self.owner = User(id=owner_id, first_name="Owner", username="owner")
+        self._next_id = 0
+        self._users = {}
+        self._groups = {}
+    
+    def _id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+    
+    def user(self, user_id: int) -> User:
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = User(
+                id=user_id, first_name=f"User{user_id}", username=f"user{user_id}" if user_id % 2 else None
+            )
+        return user
+    
+    def group(self, chat_id: int) -> Chat:
+        chat = self._groups.get(chat_id)
+        if chat is None:
+            chat = self._groups[chat_id] = Chat(id=chat_id, type=enums.ChatType.SUPERGROUP, title=f"Group {-chat_id}")
+        return chat
+    
+    def private(self, sender_id: int, text: str) -> Message:
+        sender = self.user(sender_id)
+        chat = Chat(id=sender_id, type=enums.ChatType.PRIVATE, first_name=sender.first_name)
+        return Message(id=self._id(), chat=chat, from_user=sender, date=datetime.now(), text=Str(text))
+    
+    def command(self, text: str) -> Message:
+        chat = Chat(id=self.owner_id, type=enums.ChatType.PRIVATE, first_name="Owner")
+        entities = [MessageEntity(type=enums.MessageEntityType.BOT_COMMAND, offset=0, length=len(text.split()[0]))]
+        return Message(id=self._id(), chat=chat, from_user=self.owner, date=datetime.now(),
+                       text=Str(text).init(entities), entities=entities)
+    
+    def group_message(self, chat_id: int, sender_id: int, text: str, mention_bot: bool = False,
+                      mention_owner: bool = False, reply_to_owner: bool = False) -> Message:
+        entities: List[MessageEntity] = []
+        if mention_bot:
+            mention = f"@{BOT_USERNAME}"
+            entities.append(MessageEntity(type=enums.MessageEntityType.MENTION, offset=utf16_len(text) + 1, length=len(mention)))
+            text = f"{text} {mention}"
+        if mention_owner:
+            entities.append(MessageEntity(type=enums.MessageEntityType.TEXT_MENTION, offset=utf16_len(text) + 1,
+                                          length=5, user=self.owner))
+            text = f"{text} Owner"
+        reply: Optional[Message] = None
+        if reply_to_owner:
+            reply = Message(id=self._id(), chat=self.group(chat_id), from_user=self.owner, date=datetime.now(),
+                            text=Str("earlier message"))
+        return Message(
+            id=self._id(), chat=self.group(chat_id), from_user=self.user(sender_id), date=datetime.now(),
+            text=Str(text).init(entities), entities=entities or None, reply_to_message=reply
+        )
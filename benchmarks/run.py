@@ -0,0 +1,227 @@
+"""
+Offline load-test and benchmark harness for CrushBot
+
+Runs the real CrushBot handlers against benchmarks.fake_client.FakeClient
+and replays scripted traffic mixes. No Telegram account or network access
+is needed.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --scenario busy_group --messages 20000
+    python -m benchmarks.run --latency 0.05 --floodwait-rate 0.01 --json
+    python -m benchmarks.run --scenario busy_group --watch-entries 2000 --shards 4
+"""
+import os
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+# The fake client never talks to Telegram, so dummy credentials suffice
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "benchmark")
+os.environ.setdefault("BOT_TOKEN", "1000:benchmark")
+os.environ.setdefault("OWNER_ID", "42")
+
+# Lift Telegram's send limits unless asked otherwise, so the numbers
+# measure the bot rather than the rate limiter
+if "--telegram-limits" not in sys.argv:
+    os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("OUTBOUND_PRIVATE_RATE", "1000000")
+    os.environ.setdefault("OUTBOUND_GROUP_RATE", "1000000")
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import metrics
+from config import Config
+from bot import CrushBot
+from benchmarks.fake_client import FakeClient, MessageFactory
+
+GROUP_IDS = [-1000000000 - i for i in range(20)]
+
+
+def dm_flood(factory: MessageFactory, count: int, rng: random.Random) -> list:
+    """Many private messages from a pool of senders"""
+    senders = max(1, count // 10)
+    return [factory.private(10000 + rng.randrange(senders), f"hello {i}") for i in range(count)]
+
+
+def spam_flood(factory: MessageFactory, count: int, rng: random.Random) -> list:
+    """One sender flooding the bot among a trickle of ordinary DMs"""
+    return [
+        factory.private(99999 if rng.random() < 0.9 else 10000 + rng.randrange(100), f"spam {i}")
+        for i in range(count)
+    ]
+
+
+def busy_group(factory: MessageFactory, count: int, rng: random.Random) -> list:
+    """Busy groups where only a few messages mention the bot or the owner"""
+    messages = []
+    for i in range(count):
+        roll = rng.random()
+        messages.append(factory.group_message(
+            rng.choice(GROUP_IDS), 20000 + rng.randrange(500), f"chatter {i}",
+            mention_bot=roll < 0.01,
+            mention_owner=0.01 <= roll < 0.02,
+            reply_to_owner=0.02 <= roll < 0.025
+        ))
+    return messages
+
+
+def owner_during_flood(factory: MessageFactory, count: int, rng: random.Random) -> list:
+    """A DM flood with owner commands interleaved every 50 messages"""
+    messages = dm_flood(factory, count, rng)
+    commands = ["/status", "/settings", "/stats", "/help"]
+    for position in range(len(messages) - 1, 0, -50):
+        messages.insert(position, factory.command(commands[position % len(commands)]))
+    return messages
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "dm_flood": dm_flood,
+    "spam_flood": spam_flood,
+    "busy_group": busy_group,
+    "owner_during_flood": owner_during_flood,
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile in milliseconds"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+
+async def run_scenario(name: str, args) -> dict:
+    """Replay one traffic mix and collect its measurements"""
+    rng = random.Random(args.seed)
+    client = FakeClient(
+        latency=args.latency, jitter=args.jitter,
+        floodwait_rate=args.floodwait_rate, floodwait_seconds=args.floodwait_seconds, seed=args.seed
+    )
+    messages = SCENARIOS[name](MessageFactory(Config.OWNER_ID), args.messages, rng)
+    
+    # Lane metrics are process-wide; start each scenario from zero
+    for family in (metrics.DISPATCH_LATENCY, metrics.DISPATCH_SHED, metrics.DISPATCH_QUEUED):
+        family.children.clear()
+    
+    tracemalloc.start()
+    bot = CrushBot(client=client)
+    # A large watchlist makes group classification CPU-bound
+    for i in range(args.watch_entries):
+        bot.watchlist.add(f"/\\bwatch{i}\\w*\\b/" if i % 50 == 0 else f"keyword {i}")
+    await bot.start()
+    
+    queue: asyncio.Queue = asyncio.Queue()
+    latencies: List[float] = []
+    
+    async def worker():
+        # Mirrors Pyrogram's update workers pulling from its update queue;
+        # handlers only enqueue onto the bot's lanes
+        while True:
+            try:
+                message = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            await client.dispatch(message)
+            latencies.append(time.perf_counter() - started)
+            # Real updates arrive off the network, so the loop gets a turn between them
+            await asyncio.sleep(0)
+    
+    started = time.perf_counter()
+    for message in messages:
+        queue.put_nowait(message)
+    await asyncio.gather(*(worker() for _ in range(args.workers)))
+    if bot.shards is not None:
+        await bot.shards.drain()
+    await bot.dispatcher.drain()
+    handled = time.perf_counter() - started
+    
+    bot.digest.flush()
+    await bot.outbound.drain()
+    delivered = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await bot.stop()
+    
+    outbound = client.outbound_calls()
+    owner_lane = metrics.DISPATCH_LATENCY.children.get("owner")
+    return {
+        "scenario": name,
+        "messages": len(messages),
+        "messages_per_second": round(len(messages) / handled, 1),
+        "handler_p50_ms": round(percentile(latencies, 0.50), 3),
+        "handler_p99_ms": round(percentile(latencies, 0.99), 3),
+        # Bucket upper bound, from arrival to command handled
+        "owner_command_p99_ms": owner_lane.quantile(0.99) * 1000 if owner_lane and owner_lane.count else None,
+        "outbound_calls": outbound,
+        "outbound_per_inbound": round(outbound / len(messages), 3),
+        "floodwaits": client.floodwaits,
+        "shed": sum(counter.value for counter in metrics.DISPATCH_SHED.children.values()),
+        "drain_seconds": round(delivered - handled, 3),
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+    }
+
+
+def print_report(results: List[dict]):
+    """Print results as an aligned table"""
+    columns = list(results[0].keys())
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for result in results:
+        print("  ".join(str(result[c]).ljust(widths[c]) for c in columns))
+
+
+async def main_async(args) -> List[dict]:
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = []
+    for name in names:
+        # Fresh working directory so settings, cooldowns and the archive start empty
+        with tempfile.TemporaryDirectory() as workdir:
+            previous = os.getcwd()
+            os.chdir(workdir)
+            try:
+                results.append(await run_scenario(name, args))
+            finally:
+                os.chdir(previous)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline CrushBot benchmark")
+    parser.add_argument("--scenario", default="all", choices=["all", *SCENARIOS])
+    parser.add_argument("--messages", type=int, default=5000, help="inbound messages per scenario")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent update workers")
+    parser.add_argument("--latency", type=float, default=0.0, help="API call latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency in seconds")
+    parser.add_argument("--floodwait-rate", type=float, default=0.0, help="probability an API call raises FloodWait")
+    parser.add_argument("--floodwait-seconds", type=int, default=1)
+    parser.add_argument("--telegram-limits", action="store_true", help="keep Telegram's real send rate limits")
+    parser.add_argument("--shards", type=int, default=0, help="classify group messages on this many processes")
+    parser.add_argument("--watch-entries", type=int, default=0, help="watchlist keywords and patterns to load")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.ERROR)
+    Config.SHARD_WORKERS = args.shards
+    results = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,96 +4,404 @@ A bot that monitors messages, forwards them to the owner, and sends offline noti
 """
 import logging
 import asyncio
+import re
+import time
 from datetime import datetime
-from pyrogram import Client, filters, enums
+from typing import Callable, Optional
+from pyrogram import Client, filters, enums, idle
+from pyrogram.errors import RPCError
 from pyrogram.types import Message
-from pyrogram.errors import FloodWait, RPCError
-from config import Config, Settings
+from config import Config, Settings, Tenant
+from outbound import OutboundScheduler
+from outbox import Outbox
+from dispatch import UpdateDispatcher
+from digest import DigestBuffer
+from cooldown import ReplyCooldown
+from archive import MessageArchive
+from watchlist import Watchlist
+from floodguard import FloodGuard
+from mediaindex import MediaIndex
+from profiles import ProfileCache
+from activity import ActivityTracker
+from shards import ShardPool
+from logging_setup import setup_logging
+from formatting import MAX_CAPTION_LENGTH, MAX_TEXT_LENGTH, build_header, shift_entities, utf16_len
+import metrics
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('crushbot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Appended to an owner command's reply when its settings change didn't reach disk
+SAVE_FAILED = "⚠️ The change is active but could not be saved yet; it will be retried. Check logs for details."
+
+# Media types that can be re-sent by file_id with a caption
+COPYABLE_MEDIA = {
+    enums.MessageMediaType.PHOTO,
+    enums.MessageMediaType.VIDEO,
+    enums.MessageMediaType.AUDIO,
+    enums.MessageMediaType.DOCUMENT,
+    enums.MessageMediaType.ANIMATION,
+    enums.MessageMediaType.VOICE,
+}
+
 
 class CrushBot:
     """Personal Assistant Telegram Bot"""
     
-    def __init__(self):
-        """Initialize the bot"""
+    def __init__(self, client: Client = None, tenant: Tenant = None,
+                 archive: MessageArchive = None, outbox: Outbox = None):
+        """Initialize the bot, optionally on a pre-built client.
+        
+        A TenantHost passes the tenant plus the archive and outbox it
+        shares between tenants; it then also owns their lifecycle.
+        """
+        self.tenant = tenant or Tenant.default()
+        self.owner_id = self.tenant.owner_id
+        self._hosted = archive is not None
+        
         # Validate configuration
-        if not Config.validate():
+        if not Config.validate(self.tenant):
+            if tenant:
+                raise ValueError(f"Tenant {tenant.name} needs API_ID, API_HASH, bot_token and owner_id")
             missing = [var for var in Config.get_required_vars() 
                       if not getattr(Config, var, None)]
             raise ValueError(f"Missing required configuration: {', '.join(missing)}")
         
         # Initialize settings
-        self.settings = Settings()
+        self.settings = Settings(self.tenant.path(Config.SETTINGS_FILE))
+        
+        # Bot identity, resolved once at startup (see refresh_identity)
+        self.bot_id = None
+        self.bot_username = None
         
         # Initialize Pyrogram client
-        self.app = Client(
+        client_options = {}
+        if self.tenant.data_dir:
+            client_options = {"workdir": self.tenant.data_dir, "workers": Config.TENANT_CLIENT_WORKERS}
+        self.app = client or Client(
             "crushbot_session",
             api_id=Config.API_ID,
             api_hash=Config.API_HASH,
-            bot_token=Config.BOT_TOKEN
+            bot_token=self.tenant.bot_token,
+            **client_options
+        )
+        
+        # Owner deliveries are logged here before sending and replayed after a crash
+        self.outbox = outbox or Outbox()
+        
+        # Every outbound API call goes through the rate-limited scheduler
+        self.outbound = OutboundScheduler(self.app, outbox=self.outbox, tenant=self.tenant.name)
+        
+        # Owner notifications are buffered here while digest mode is on
+        self.digest = DigestBuffer(self.outbound, self.owner_id, self.settings)
+        
+        # Senders get the offline reply at most once per cooldown window
+        self.cooldowns = ReplyCooldown(self.settings, self.tenant.path(Config.COOLDOWN_FILE))
+        
+        # Media the owner already received, so re-shares become references
+        self.media_index = MediaIndex(self.settings, self.tenant.path(Config.MEDIA_INDEX_FILE))
+        
+        # Local searchable record of every processed message
+        self.archive = archive or MessageArchive()
+        
+        # Keywords and regexes that make a group message relevant
+        self.watchlist = Watchlist(self.settings)
+        
+        # Sender and chat names learned from updates, for notifications
+        self.profiles = ProfileCache(self.app)
+        
+        # Message counts per sender and group for /report
+        self.activity = ActivityTracker()
+        
+        # Per-sender and per-chat rate limits, applied in the handler filters
+        self.flood_guard = FloodGuard(self.settings, self._send_owner_notice)
+        
+        # Worker processes that classify group messages (off unless SHARD_WORKERS is set)
+        self.shards = ShardPool(Config.SHARD_WORKERS, self._handle_shard_results) if Config.SHARD_WORKERS else None
+        
+        # Set once start() has warmed everything up; update handling waits for it
+        self.ready = asyncio.Event()
+        # Set when stop() begins; updates still arriving are dropped, not held
+        self.stopping = asyncio.Event()
+        
+        # Prometheus-text endpoint (disabled unless METRICS_PORT is set);
+        # hosted tenants share the host's
+        self.metrics_server = None if self._hosted else metrics.MetricsServer(ready=self.ready.is_set)
+        
+        # Handlers run on prioritised lanes instead of Pyrogram's shared workers
+        self.dispatcher = UpdateDispatcher()
+        self.dispatcher.add_lane("owner", Config.DISPATCH_OWNER_WORKERS, Config.DISPATCH_OWNER_QUEUE)
+        self.dispatcher.add_lane(
+            "dm", Config.DISPATCH_DM_WORKERS, Config.DISPATCH_DM_QUEUE,
+            Config.DISPATCH_SHED_POLICY, overflow=self._shed_to_digest
+        )
+        self.dispatcher.add_lane(
+            "group", Config.DISPATCH_GROUP_WORKERS, Config.DISPATCH_GROUP_QUEUE,
+            Config.DISPATCH_SHED_POLICY, overflow=self._shed_to_digest
         )
         
         # Register handlers
         self._register_handlers()
         
-        logger.info("CrushBot initialized successfully")
+        logger.info("CrushBot initialized successfully%s", f" for tenant {self.tenant.name}" if self.tenant.name else "")
     
     def _register_handlers(self):
         """Register message and command handlers"""
         
-        # Command handlers
-        @self.app.on_message(filters.command("start") & filters.private & filters.user(Config.OWNER_ID))
+        # Command handlers, on the owner lane so floods never delay them
+        @self.app.on_message(filters.command("start") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("start")
         async def start_command(client, message: Message):
             await self.handle_start(message)
         
-        @self.app.on_message(filters.command("enable") & filters.private & filters.user(Config.OWNER_ID))
+        @self.app.on_message(filters.command("enable") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("enable")
         async def enable_command(client, message: Message):
             await self.handle_enable(message)
         
-        @self.app.on_message(filters.command("disable") & filters.private & filters.user(Config.OWNER_ID))
+        @self.app.on_message(filters.command("disable") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("disable")
         async def disable_command(client, message: Message):
             await self.handle_disable(message)
         
-        @self.app.on_message(filters.command("status") & filters.private & filters.user(Config.OWNER_ID))
+        @self.app.on_message(filters.command("status") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("status")
         async def status_command(client, message: Message):
             await self.handle_status(message)
         
-        @self.app.on_message(filters.command("settings") & filters.private & filters.user(Config.OWNER_ID))
+        @self.app.on_message(filters.command("settings") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("settings")
         async def settings_command(client, message: Message):
             await self.handle_settings(message)
         
-        @self.app.on_message(filters.command("setoffline") & filters.private & filters.user(Config.OWNER_ID))
+        @self.app.on_message(filters.command("setoffline") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("setoffline")
         async def setoffline_command(client, message: Message):
             await self.handle_set_offline_message(message)
         
-        @self.app.on_message(filters.command("help") & filters.private & filters.user(Config.OWNER_ID))
+        @self.app.on_message(filters.command("setcooldown") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("setcooldown")
+        async def setcooldown_command(client, message: Message):
+            await self.handle_set_cooldown(message)
+        
+        @self.app.on_message(filters.command("forwardmode") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("forwardmode")
+        async def forwardmode_command(client, message: Message):
+            await self.handle_forward_mode(message)
+        
+        @self.app.on_message(filters.command("digest") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("digest")
+        async def digest_command(client, message: Message):
+            await self.handle_digest(message)
+        
+        @self.app.on_message(filters.command("search") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("search")
+        async def search_command(client, message: Message):
+            await self.handle_search(message)
+        
+        @self.app.on_message(filters.command("history") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("history")
+        async def history_command(client, message: Message):
+            await self.handle_history(message)
+        
+        @self.app.on_message(filters.command("mutes") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("mutes")
+        async def mutes_command(client, message: Message):
+            await self.handle_mutes(message)
+        
+        @self.app.on_message(filters.command("unmute") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("unmute")
+        async def unmute_command(client, message: Message):
+            await self.handle_unmute(message)
+        
+        @self.app.on_message(filters.command("watch") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("watch")
+        async def watch_command(client, message: Message):
+            await self.handle_watch(message)
+        
+        @self.app.on_message(filters.command("report") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("report")
+        async def report_command(client, message: Message):
+            await self.handle_report(message)
+        
+        @self.app.on_message(filters.command("stats") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("stats")
+        async def stats_command(client, message: Message):
+            await self.handle_stats(message)
+        
+        @self.app.on_message(filters.command("help") & filters.private & filters.user(self.owner_id))
+        @self.dispatcher.lane("owner")
+        @metrics.instrument("help")
         async def help_command(client, message: Message):
             await self.handle_help(message)
         
         # Incoming message handler (for non-owner messages)
-        @self.app.on_message(filters.private & ~filters.user(Config.OWNER_ID) & ~filters.bot)
+        @self.app.on_message(filters.private & ~filters.user(self.owner_id) & ~filters.bot & self._flood_filter())
+        @self.dispatcher.lane("dm")
+        @metrics.instrument("incoming_private_message")
         async def incoming_private_message(client, message: Message):
             await self.handle_incoming_message(message)
         
-        # Group message handler (mentions and direct interactions)
-        @self.app.on_message(filters.group & ~filters.bot)
-        async def group_message(client, message: Message):
-            await self.handle_group_message(message)
+        # Group message handler (mentions and direct interactions).
+        # The relevance filter runs last so irrelevant traffic is dropped
+        # before a handler task is ever scheduled.
+        @self.app.on_message(filters.group & ~filters.bot & self._group_relevance_filter())
+        @self.dispatcher.lane("group")
+        @metrics.instrument("group_message")
+        async def group_message(client, message: Message, mentions=None, hits=None):
+            await self.handle_group_message(message, mentions, hits)
+        
+        # Sharded messages re-enter here once classified
+        self._group_message = group_message
+    
+    def _shed_to_digest(self, client, message: Message, mentions=None, hits=None):
+        """Overflow handler for full lanes: archive the message and queue it for the next digest"""
+        private = message.chat.type == enums.ChatType.PRIVATE
+        if private:
+            self.activity.record("dm", *self.profiles.sender(message))
+        else:
+            self._record_group_activity(message)
+        if self.settings.get("archive_messages"):
+            self.archive.record(message, "dm" if private else "group", self.tenant.name)
+        if not self.settings.is_enabled():
+            return
+        # The same notifications, gated by the same settings, as the lane handlers would send
+        kinds = []
+        if private:
+            if self.settings.get("forward_messages"):
+                kinds.append("dm")
+        else:
+            mentioned_bot, mentioned_owner = mentions or self._check_mentions(message, self.bot_username)
+            if mentioned_bot and self.settings.get("forward_messages"):
+                kinds.append("bot_mention")
+            if self.settings.get("direct_message_alerts"):
+                if mentioned_owner or self._is_owner_reply(message):
+                    kinds.append("owner_mention")
+                else:
+                    if hits is None:
+                        hits = self.watchlist.match(message.text or message.caption)
+                    if hits:
+                        kinds.append("watch")
+        if not kinds:
+            return
+        sender_id, sender_info = self.profiles.sender(message)
+        for kind in kinds:
+            self.digest.add(kind, message, sender_info, sender_id)
+    
+    def _group_relevance_filter(self):
+        """Build a filter that only passes group messages the bot must act on"""
+        bot = self
+        
+        # Must be a coroutine function: Pyrogram runs plain callables in its
+        # thread pool executor, which would cost a thread hop per message.
+        async def func(flt, client, message: Message):
+            if (not bot.ready.is_set() or bot.stopping.is_set()) and not await bot._wait_ready():
+                return False
+            # Learn names from all group traffic, including the owner's own
+            # messages, so later replies and notifications need no lookups
+            bot.profiles.observe(message)
+            if not bot.settings.is_enabled():
+                return False
+            # Anonymous admins and channels have no from_user and are
+            # identified by sender_chat instead
+            sender_id, sender_info = bot.profiles.sender(message)
+            if sender_id is None or sender_id == bot.owner_id:
+                return False
+            if bot.shards is not None and bot.shards.submit(message, (sender_id, sender_info)):
+                # Classified on a shard worker; continues in _handle_shard_results
+                return False
+            mentioned_bot, mentioned_owner = bot._check_mentions(message, bot.bot_username)
+            relevant = (
+                mentioned_bot or mentioned_owner or bot._is_owner_reply(message)
+                or bool(bot.watchlist.match(message.text or message.caption))
+            )
+            # Only relevant messages count towards the flood limits, so a
+            # busy group is never muted just for being busy
+            return relevant and bot.flood_guard.check(
+                sender_id, sender_info, message.chat.id, bot.profiles.chat_label(message.chat)
+            )
+        
+        return filters.create(func, "GroupRelevanceFilter")
+    
+    async def _handle_shard_results(self, results):
+        """Apply the relevance filter's remaining checks to classified group messages, in order"""
+        for message, (sender_id, sender_info), (_, mentioned_bot, mentioned_owner, hits) in results:
+            relevant = mentioned_bot or mentioned_owner or hits or self._is_owner_reply(message)
+            if relevant and self.flood_guard.check(
+                sender_id, sender_info, message.chat.id, self.profiles.chat_label(message.chat)
+            ):
+                await self._group_message(self.app, message, (mentioned_bot, mentioned_owner), hits)
+    
+    def _flood_filter(self):
+        """Build a filter that rejects private messages from flooding senders"""
+        bot = self
+        
+        async def func(flt, client, message: Message):
+            if (not bot.ready.is_set() or bot.stopping.is_set()) and not await bot._wait_ready():
+                return False
+            if not message.from_user:
+                return True
+            bot.profiles.observe(message)
+            if not bot.settings.is_enabled():
+                # The handler only archives and logs the message; flood
+                # checks would still send mute notices to the owner
+                return True
+            return bot.flood_guard.check(message.from_user.id, bot.profiles.user_label(message.from_user))
+        
+        return filters.create(func, "FloodFilter")
+    
+    async def _wait_ready(self) -> bool:
+        """Wait until start() has finished; False if the bot is shutting down instead"""
+        if not self.ready.is_set() and not self.stopping.is_set():
+            waiters = [asyncio.ensure_future(event.wait()) for event in (self.ready, self.stopping)]
+            try:
+                await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+        return not self.stopping.is_set()
+    
+    def _send_owner_notice(self, text: str):
+        """Send the owner a one-line notice"""
+        self.outbound.send_message(self.owner_id, text)
+    
+    async def refresh_identity(self):
+        """Resolve the bot's own identity and cache it"""
+        self._set_identity(await metrics.api_call(self.app, "get_me"))
+    
+    def _set_identity(self, me):
+        """Cache the bot's own identity"""
+        if me.id != self.bot_id or me.username != self.bot_username:
+            self.bot_id = me.id
+            self.bot_username = me.username
+            logger.info("Bot identity resolved: @%s (ID: %s)", me.username, me.id)
+            self._configure_shards()
+    
+    def _configure_shards(self):
+        """Give shard workers the current bot username, owner and watchlist"""
+        if self.shards is not None:
+            self.shards.configure(self.bot_username, self.owner_id, self.settings.get("watchlist"))
     
     async def handle_start(self, message: Message):
         """Handle /start command"""
         try:
+            # /start is rare and owner-only, a cheap point to pick up a renamed bot
+            await self.refresh_identity()
             welcome_text = (
                 "👋 **Welcome to CrushBot!**\n\n"
                 "Your personal assistant bot is ready to help you.\n\n"
@@ -104,34 +412,36 @@ class CrushBot:
                 "• Customizable settings\n\n"
                 "Use /help to see all available commands."
             )
-            await message.reply_text(welcome_text)
-            logger.info(f"Start command from owner (ID: {message.from_user.id})")
+            self.outbound.reply(message, welcome_text)
+            logger.info("Start command from owner (ID: %s)", message.from_user.id)
         except Exception as e:
-            logger.error(f"Error in start command: {e}")
+            logger.error("Error in start command: %s", e)
     
     async def handle_enable(self, message: Message):
         """Enable the bot"""
         try:
-            if self.settings.enable():
-                await message.reply_text("✅ **Bot Enabled**\n\nI'm now active and will handle messages.")
-                logger.info("Bot enabled by owner")
+            self.settings.enable()
+            logger.info("Bot enabled by owner")
+            if await self.settings.flush():
+                self.outbound.reply(message, "✅ **Bot Enabled**\n\nI'm now active and will handle messages.")
             else:
-                await message.reply_text("❌ Failed to enable bot. Check logs for details.")
+                self.outbound.reply(message, f"✅ **Bot Enabled**\n\n{SAVE_FAILED}")
         except Exception as e:
-            logger.error(f"Error enabling bot: {e}")
-            await message.reply_text(f"❌ Error: {str(e)}")
+            logger.error("Error enabling bot: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
     
     async def handle_disable(self, message: Message):
         """Disable the bot"""
         try:
-            if self.settings.disable():
-                await message.reply_text("🛑 **Bot Disabled**\n\nI won't send notifications or forward messages until re-enabled.")
-                logger.info("Bot disabled by owner")
+            self.settings.disable()
+            logger.info("Bot disabled by owner")
+            if await self.settings.flush():
+                self.outbound.reply(message, "🛑 **Bot Disabled**\n\nI won't send notifications or forward messages until re-enabled.")
             else:
-                await message.reply_text("❌ Failed to disable bot. Check logs for details.")
+                self.outbound.reply(message, f"🛑 **Bot Disabled**\n\n{SAVE_FAILED}")
         except Exception as e:
-            logger.error(f"Error disabling bot: {e}")
-            await message.reply_text(f"❌ Error: {str(e)}")
+            logger.error("Error disabling bot: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
     
     async def handle_status(self, message: Message):
         """Show bot status"""
@@ -145,10 +455,10 @@ class CrushBot:
                 f"Direct Message Alerts: {'✅' if self.settings.get('direct_message_alerts') else '❌'}\n\n"
                 f"Use /settings to see all configuration options."
             )
-            await message.reply_text(settings_info)
+            self.outbound.reply(message, settings_info)
         except Exception as e:
-            logger.error(f"Error showing status: {e}")
-            await message.reply_text(f"❌ Error: {str(e)}")
+            logger.error("Error showing status: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
     
     async def handle_settings(self, message: Message):
         """Show all settings"""
@@ -157,6 +467,9 @@ class CrushBot:
             for key, value in self.settings.settings.items():
                 if key == "offline_message":
                     settings_text += f"**{key}:**\n`{value}`\n\n"
+                elif key == "watchlist":
+                    # Can be long; /watch list shows the entries themselves
+                    settings_text += f"**{key}:** {len(self.watchlist)} entries (see /watch list)\n"
                 else:
                     settings_text += f"**{key}:** `{value}`\n"
             
@@ -164,13 +477,19 @@ class CrushBot:
             settings_text += "/enable - Enable bot\n"
             settings_text += "/disable - Disable bot\n"
             settings_text += "/setoffline <message> - Set offline message\n"
+            settings_text += "/setcooldown <seconds> - Set auto-reply cooldown\n"
+            settings_text += "/digest on|off - Toggle digest mode\n"
+            settings_text += "/search <words> - Search archived messages\n"
+            settings_text += "/watch add|remove|list - Manage watched keywords\n"
+            settings_text += "/mutes - Show flood-muted senders\n"
+            settings_text += "/report [day|week] - Show activity report\n"
             settings_text += "/status - Show bot status\n"
             settings_text += "/help - Show help"
             
-            await message.reply_text(settings_text)
+            self.outbound.reply(message, settings_text[:4096])
         except Exception as e:
-            logger.error(f"Error showing settings: {e}")
-            await message.reply_text(f"❌ Error: {str(e)}")
+            logger.error("Error showing settings: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
     
     async def handle_set_offline_message(self, message: Message):
         """Set custom offline message"""
@@ -178,24 +497,273 @@ class CrushBot:
             # Extract message after command
             parts = message.text.split(maxsplit=1)
             if len(parts) < 2:
-                await message.reply_text(
+                self.outbound.reply(
+                    message,
                     "ℹ️ **Usage:** /setoffline <your custom message>\n\n"
                     "Example: /setoffline I'm currently unavailable. I'll get back to you soon!"
                 )
                 return
             
             new_message = parts[1]
-            if self.settings.set("offline_message", new_message):
-                await message.reply_text(
-                    f"✅ **Offline message updated!**\n\n"
-                    f"New message:\n{new_message}"
+            self.settings.set("offline_message", new_message)
+            logger.info("Offline message updated by owner")
+            saved = await self.settings.flush()
+            self.outbound.reply(
+                message,
+                f"✅ **Offline message updated!**\n\n"
+                f"New message:\n{new_message}" + ("" if saved else f"\n\n{SAVE_FAILED}")
+            )
+        except Exception as e:
+            logger.error("Error setting offline message: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_set_cooldown(self, message: Message):
+        """Set the auto-reply cooldown window"""
+        try:
+            parts = message.text.split(maxsplit=1)
+            if len(parts) < 2 or not parts[1].strip().isdigit():
+                self.outbound.reply(
+                    message,
+                    f"ℹ️ **Usage:** /setcooldown <seconds>\n\n"
+                    f"Current cooldown: {self.settings.get('auto_reply_cooldown')} seconds\n"
+                    f"Use 0 to reply to every message."
+                )
+                return
+            
+            seconds = int(parts[1])
+            self.settings.set("auto_reply_cooldown", seconds)
+            logger.info("Auto-reply cooldown set to %ss by owner", seconds)
+            saved = await self.settings.flush()
+            self.outbound.reply(
+                message, f"✅ **Auto-reply cooldown set to {seconds} seconds.**" + ("" if saved else f"\n\n{SAVE_FAILED}")
+            )
+        except Exception as e:
+            logger.error("Error setting cooldown: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_forward_mode(self, message: Message):
+        """Show or change how messages are delivered to the owner"""
+        try:
+            parts = message.text.split(maxsplit=1)
+            mode = parts[1].strip().lower() if len(parts) > 1 else ""
+            if mode not in ("copy", "forward"):
+                self.outbound.reply(
+                    message,
+                    f"ℹ️ **Usage:** /forwardmode copy|forward\n\n"
+                    f"Current mode: `{self.settings.get('forward_mode')}`\n"
+                    f"• copy - header and message in one message\n"
+                    f"• forward - header message followed by a forward"
+                )
+                return
+            
+            self.settings.set("forward_mode", mode)
+            logger.info("Forward mode set to %s by owner", mode)
+            saved = await self.settings.flush()
+            self.outbound.reply(message, f"✅ Forward mode set to **{mode}**." + ("" if saved else f"\n\n{SAVE_FAILED}"))
+        except Exception as e:
+            logger.error("Error setting forward mode: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_digest(self, message: Message):
+        """Show or toggle digest mode"""
+        try:
+            parts = message.text.split(maxsplit=1)
+            if len(parts) < 2:
+                state = "✅ On" if self.settings.get("digest_mode") else "❌ Off"
+                self.outbound.reply(
+                    message,
+                    f"🗞️ **Digest Mode:** {state}\n\n"
+                    f"Window: {self.settings.get('digest_window')} seconds\n"
+                    f"Max messages per digest: {self.settings.get('digest_max_events')}\n"
+                    f"Buffered now: {len(self.digest)}\n\n"
+                    f"**Usage:** /digest on|off"
+                )
+                return
+            
+            arg = parts[1].strip().lower()
+            if arg not in ("on", "off"):
+                self.outbound.reply(message, "ℹ️ **Usage:** /digest on|off")
+                return
+            
+            enabled = arg == "on"
+            if not enabled:
+                # Deliver whatever is still buffered before switching back
+                self.digest.flush()
+            self.settings.set("digest_mode", enabled)
+            logger.info("Digest mode turned %s by owner", arg)
+            saved = await self.settings.flush()
+            self.outbound.reply(message, f"✅ Digest mode turned **{arg}**." + ("" if saved else f"\n\n{SAVE_FAILED}"))
+        except Exception as e:
+            logger.error("Error toggling digest mode: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_search(self, message: Message):
+        """Search the local message archive"""
+        try:
+            parts = message.text.split(maxsplit=1)
+            if len(parts) < 2:
+                self.outbound.reply(message, "ℹ️ **Usage:** /search <words>")
+                return
+            
+            rows = await self.archive.search(parts[1], self.tenant.name)
+            self.outbound.reply(message, self._format_archive_rows(f"🔎 **Search:** {parts[1]}", rows))
+        except Exception as e:
+            logger.error("Error searching archive: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_history(self, message: Message):
+        """Show recent archived messages from a user"""
+        try:
+            parts = message.text.split(maxsplit=1)
+            if len(parts) < 2:
+                self.outbound.reply(message, "ℹ️ **Usage:** /history <user ID or @username>")
+                return
+            
+            user = parts[1].strip()
+            rows = await self.archive.history(int(user) if user.lstrip("-").isdigit() else user, self.tenant.name)
+            self.outbound.reply(message, self._format_archive_rows(f"🗂️ **History:** {user}", rows))
+        except Exception as e:
+            logger.error("Error reading archive history: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_watch(self, message: Message):
+        """Add, remove or list watched keywords and patterns"""
+        try:
+            parts = message.text.split(maxsplit=2)
+            action = parts[1].lower() if len(parts) > 1 else ""
+            if action == "list":
+                entries = self.watchlist.entries()
+                if not entries:
+                    self.outbound.reply(message, "👀 **Watchlist is empty.**")
+                    return
+                listing = "\n".join(f"• `{entry}`" for entry in entries)
+                self.outbound.reply(message, f"👀 **Watchlist:**\n\n{listing}"[:4096])
+                return
+            
+            if action not in ("add", "remove") or len(parts) < 3:
+                self.outbound.reply(
+                    message,
+                    "ℹ️ **Usage:** /watch add|remove <keyword or /regex/>\n"
+                    "/watch list\n\n"
+                    "Example: /watch add crush\n"
+                    "Example: /watch add /\\bcr[u0]sh(y|ie)?\\b/"
+                )
+                return
+            
+            entry = parts[2].strip()
+            if action == "add":
+                try:
+                    added = self.watchlist.add(entry)
+                except re.error as e:
+                    self.outbound.reply(message, f"❌ Invalid regex: {e}")
+                    return
+                reply = f"✅ Now watching `{entry}`." if added else f"ℹ️ `{entry}` is already watched."
+            else:
+                removed = self.watchlist.remove(entry)
+                reply = f"✅ Stopped watching `{entry}`." if removed else f"ℹ️ `{entry}` is not on the watchlist."
+            self._configure_shards()
+            self.outbound.reply(message, reply)
+            logger.info("Watchlist %s by owner: %s", action, entry)
+        except Exception as e:
+            logger.error("Error updating watchlist: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_mutes(self, message: Message):
+        """Show senders and chats muted by the flood guard"""
+        try:
+            mutes = self.flood_guard.mutes()
+            if not mutes:
+                self.outbound.reply(message, "🔈 **No one is muted.**")
+                return
+            
+            lines = ["🔇 **Muted for flooding:**\n"]
+            for (kind, target_id), label, seconds_left, suppressed in mutes:
+                lines.append(
+                    f"• {'Group' if kind == 'chat' else 'User'} {label} (ID: `{target_id}`) - "
+                    f"{seconds_left // 60}m {seconds_left % 60}s left, {suppressed} suppressed"
                 )
-                logger.info("Offline message updated by owner")
+            lines.append("\nUse /unmute <ID> or /unmute all to lift a mute.")
+            self.outbound.reply(message, "\n".join(lines)[:4096])
+        except Exception as e:
+            logger.error("Error showing mutes: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_unmute(self, message: Message):
+        """Lift one or all flood-guard mutes"""
+        try:
+            parts = message.text.split(maxsplit=1)
+            target = parts[1].strip().lower() if len(parts) > 1 else ""
+            if target != "all" and not target.lstrip("-").isdigit():
+                self.outbound.reply(message, "ℹ️ **Usage:** /unmute <user or chat ID>|all")
+                return
+            
+            count = self.flood_guard.unmute(None if target == "all" else int(target))
+            if count:
+                self.outbound.reply(message, f"✅ Lifted {count} mute{'s' if count != 1 else ''}.")
+                logger.info("Flood guard: %s mutes lifted by owner", count)
             else:
-                await message.reply_text("❌ Failed to update offline message.")
+                self.outbound.reply(message, "ℹ️ Nothing to unmute.")
+        except Exception as e:
+            logger.error("Error lifting mute: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    def _format_archive_rows(self, title: str, rows) -> str:
+        """Render archive query results for the owner"""
+        if not rows:
+            return f"{title}\n\nNo messages found."
+        
+        lines = [f"{title}\n"]
+        for date, kind, chat_id, chat_title, sender_id, username, name, media, text in rows:
+            sender_info = f"@{username}" if username else (name or str(sender_id))
+            where = f" in {chat_title}" if chat_title else ""
+            body = text or (f"[{media}]" if media else "")
+            if len(body) > 200:
+                body = body[:200] + "…"
+            lines.append(
+                f"• {datetime.fromtimestamp(date).strftime('%Y-%m-%d %H:%M')} "
+                f"{sender_info}{where}:\n{body}"
+            )
+        return "\n".join(lines)[:4096]
+    
+    async def handle_report(self, message: Message):
+        """Show the busiest senders, groups and hours"""
+        try:
+            parts = message.text.split(maxsplit=1)
+            period = parts[1].strip().lower() if len(parts) > 1 else "day"
+            if period not in ("day", "week"):
+                self.outbound.reply(message, "ℹ️ **Usage:** /report [day|week]")
+                return
+            
+            report = self.activity.report(period)
+            totals = report["totals"]
+            lines = [
+                f"📈 **Activity Report** ({'last 24 hours' if period == 'day' else 'last 7 days'})\n",
+                f"Messages: {totals['dm'] + totals['group']} ({totals['dm']} private, {totals['group']} in groups)",
+                f"Last hour: {report['last_hour']}\n",
+                "**Top senders:**",
+            ]
+            lines += [
+                f"{rank}. {label} (ID: `{sender_id}`) - {count}"
+                for rank, (sender_id, label, count) in enumerate(report["senders"], 1)
+            ] or ["None"]
+            lines.append("\n**Top groups:**")
+            lines += [
+                f"{rank}. {label} - {count}" for rank, (_, label, count) in enumerate(report["groups"], 1)
+            ] or ["None"]
+            lines.append("\n**Peak hours:**")
+            lines += [f"• {hour:02d}:00-{hour:02d}:59 - {count}" for hour, count in report["peak_hours"]] or ["None"]
+            self.outbound.reply(message, "\n".join(lines)[:4096])
         except Exception as e:
-            logger.error(f"Error setting offline message: {e}")
-            await message.reply_text(f"❌ Error: {str(e)}")
+            logger.error("Error building report: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
+    
+    async def handle_stats(self, message: Message):
+        """Show runtime metrics"""
+        try:
+            self.outbound.reply(message, metrics.format_stats())
+        except Exception as e:
+            logger.error("Error showing stats: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
     
     async def handle_help(self, message: Message):
         """Show help message"""
@@ -209,6 +777,17 @@ class CrushBot:
                 "/status - Show current bot status\n"
                 "/settings - View all settings\n"
                 "/setoffline <message> - Set custom offline message\n"
+                "/setcooldown <seconds> - Set auto-reply cooldown per sender\n"
+                "/forwardmode copy|forward - Choose how messages reach you\n"
+                "/digest on|off - Batch forwarded messages into digests\n"
+                "/search <words> - Search archived messages\n"
+                "/history <user> - Recent archived messages from a user\n"
+                "/watch add|remove <word or /regex/> - Get alerted on keywords in groups\n"
+                "/watch list - Show watched keywords\n"
+                "/mutes - Show senders and chats muted for flooding\n"
+                "/unmute <ID>|all - Lift a flood mute\n"
+                "/report [day|week] - Top senders, groups and peak hours\n"
+                "/stats - Show runtime metrics\n"
                 "/help - Show this help message\n\n"
                 "**Features:**\n"
                 "• Automatically forwards messages to you\n"
@@ -217,61 +796,56 @@ class CrushBot:
                 "• Customizable settings and messages\n\n"
                 "**Note:** Only you (the owner) can control this bot."
             )
-            await message.reply_text(help_text)
+            self.outbound.reply(message, help_text)
         except Exception as e:
-            logger.error(f"Error showing help: {e}")
-            await message.reply_text(f"❌ Error: {str(e)}")
+            logger.error("Error showing help: %s", e)
+            self.outbound.reply(message, f"❌ Error: {str(e)}")
     
     async def handle_incoming_message(self, message: Message):
         """Handle incoming private messages from non-owner users"""
+        started = time.perf_counter()
         try:
+            self.activity.record("dm", *self.profiles.sender(message))
+            if self.settings.get("archive_messages"):
+                self.archive.record(message, "dm", self.tenant.name)
+            
             # Check if bot is enabled
             if not self.settings.is_enabled():
-                logger.info(f"Ignored message from {message.from_user.id} (bot disabled)")
+                logger.info("Ignored message from %s (bot disabled)", message.from_user.id)
                 return
             
-            sender = message.from_user
-            sender_info = f"@{sender.username}" if sender.username else f"{sender.first_name}"
-            sender_id = sender.id
+            sender_id, sender_info = await self.profiles.resolve_sender(message)
             
             # Forward message to owner if enabled
             if self.settings.get("forward_messages"):
                 try:
-                    # Create forwarding header
-                    forward_header = (
-                        f"📨 **New Message**\n"
-                        f"From: {sender_info} (ID: `{sender_id}`)\n"
-                        f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                        f"{'─' * 30}\n"
-                    )
+                    self._notify_owner(message, "dm", "📨", "New Message", sender_info, sender_id)
                     
-                    # Send header to owner
-                    await self.app.send_message(
-                        Config.OWNER_ID,
-                        forward_header
+                    logger.info(
+                        "Queued forward of message from %s to owner", sender_id,
+                        extra={"handler": "dm", "sender_id": sender_id, "chat_id": message.chat.id}
                     )
-                    
-                    # Forward the actual message
-                    await message.forward(Config.OWNER_ID)
-                    
-                    logger.info(f"Forwarded message from {sender_id} to owner")
-                except FloodWait as e:
-                    logger.warning(f"FloodWait: sleeping for {e.value} seconds")
-                    await asyncio.sleep(e.value)
                 except Exception as e:
-                    logger.error(f"Error forwarding message: {e}")
+                    logger.error("Error forwarding message: %s", e)
             
             # Send offline notification to sender if enabled
-            if self.settings.get("offline_notification"):
+            if (self.settings.get("offline_notification")
+                    and self.cooldowns.should_reply(message.chat.id, sender_id)):
                 try:
                     offline_msg = self.settings.get_offline_message()
-                    await message.reply_text(offline_msg)
-                    logger.info(f"Sent offline notification to {sender_id}")
+                    self.outbound.reply(message, offline_msg)
+                    logger.info("Queued offline notification to %s", sender_id)
                 except Exception as e:
-                    logger.error(f"Error sending offline notification: {e}")
+                    logger.error("Error sending offline notification: %s", e)
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Handled message from %s", sender_id, extra={
+                    "handler": "dm", "sender_id": sender_id, "chat_id": message.chat.id,
+                    "latency_ms": round((time.perf_counter() - started) * 1000, 3)
+                })
         
         except Exception as e:
-            logger.error(f"Error handling incoming message: {e}")
+            logger.error("Error handling incoming message: %s", e)
     
     def _check_mentions(self, message: Message, bot_username: str):
         """Check if bot or owner is mentioned in the message"""
@@ -281,45 +855,186 @@ class CrushBot:
         if message.entities:
             for entity in message.entities:
                 if entity.type == enums.MessageEntityType.MENTION:
-                    mention = message.text[entity.offset:entity.offset + entity.length]
-                    if mention == f"@{bot_username}":
+                    if not bot_username:
+                        continue
+                    mention = message.text[entity.offset + 1:entity.offset + entity.length]
+                    if mention.lower() == bot_username.lower():
                         mentioned_bot = True
                 elif entity.type == enums.MessageEntityType.TEXT_MENTION:
-                    if entity.user.id == Config.OWNER_ID:
+                    if entity.user and entity.user.id == self.owner_id:
                         mentioned_owner = True
         
         return mentioned_bot, mentioned_owner
     
-    def _get_sender_info(self, sender):
-        """Get formatted sender information"""
-        return f"@{sender.username}" if sender.username else f"{sender.first_name}"
+    def _notify_owner(self, message: Message, kind: str, icon: str, title: str, sender_info: str, sender_id: int):
+        """Deliver a message to the owner, directly or through the digest"""
+        if self.settings.get("digest_mode"):
+            self.digest.add(kind, message, sender_info, sender_id)
+            return
+        self._deliver_to_owner(message, kind, icon, title, sender_info, sender_id)
+    
+    def _deliver_to_owner(self, message: Message, kind: str, icon: str, title: str, sender_info: str, sender_id: int):
+        """Send a message to the owner now, or a reference if they already have its media"""
+        # Idempotency key for the outbox: one delivery per source message and kind
+        key = f"{message.chat.id}:{message.id}:{kind}"
+        
+        media_key = self.media_index.key(message)
+        if media_key is not None:
+            earlier = self.media_index.earlier(media_key)
+            if earlier is not None:
+                self._reference_media(
+                    message, earlier, media_key[0], sender_info, sender_id, key,
+                    lambda: self._deliver_to_owner(message, kind, icon, title, sender_info, sender_id)
+                )
+                return
+        
+        delivery = None
+        if self.settings.get("forward_mode") == "copy":
+            delivery = self._copy_to_owner(message, f"{icon} {title}", sender_info, sender_id, key)
+        
+        if delivery is None:
+            delivery = self._forward_with_header(message, icon, title, sender_info, sender_id, key)
+        else:
+            delivery = self._or_forward(
+                delivery, lambda: self._forward_with_header(message, icon, title, sender_info, sender_id, key)
+            )
+        
+        if media_key is not None:
+            self.media_index.remember(media_key, delivery)
+    
+    def _forward_with_header(self, message: Message, icon: str, title: str, sender_info: str, sender_id: int,
+                             key: str) -> asyncio.Future:
+        """Send the owner a header, then forward the message itself"""
+        # Header and message share the owner chat lane, so they stay in order
+        group_line = "" if message.chat.type == enums.ChatType.PRIVATE else f"Group: {message.chat.title}\n"
+        header = (
+            f"{icon} **{title}**\n"
+            f"{group_line}"
+            f"From: {sender_info} (ID: `{sender_id}`)\n"
+            f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"{'─' * 30}\n"
+        )
+        self.outbound.send_message(self.owner_id, header, idempotency_key=f"{key}:header")
+        return self.outbound.forward(message, self.owner_id, idempotency_key=f"{key}:forward")
+    
+    @staticmethod
+    def _or_forward(copy: asyncio.Future, forward: Callable[[], asyncio.Future]) -> asyncio.Future:
+        """Future of a copy delivery that falls back to forward() if Telegram rejects the copy.
+        
+        A copy can be refused where a forward isn't, e.g. for custom emoji
+        entities the bot may not send.
+        """
+        delivered = asyncio.get_event_loop().create_future()
+        # Mark errors as retrieved; whoever cares inspects the future
+        delivered.add_done_callback(lambda future: future.cancelled() or future.exception())
+        
+        def settle(future: asyncio.Future):
+            if delivered.done():
+                return
+            if future.cancelled():
+                delivered.cancel()
+            elif future.exception() is not None:
+                delivered.set_exception(future.exception())
+            else:
+                delivered.set_result(future.result())
+        
+        def copied(future: asyncio.Future):
+            if not future.cancelled() and isinstance(future.exception(), RPCError):
+                logger.warning("Owner copy rejected (%s), forwarding instead", future.exception())
+                forward().add_done_callback(settle)
+            else:
+                settle(future)
+        
+        copy.add_done_callback(copied)
+        return delivered
+    
+    def _reference_media(self, message: Message, earlier: asyncio.Future, media_type: str,
+                         sender_info: str, sender_id: int, key: str, fallback: Callable[[], None]):
+        """Point the owner at an earlier delivery of the same media instead of forwarding it again.
+        
+        If that delivery turns out to have failed, fallback delivers this message in full.
+        """
+        group_line = "" if message.chat.type == enums.ChatType.PRIVATE else f" in {message.chat.title}"
+        text = f"🔁 Same {media_type.replace('_', ' ')} as ↑, sent again by {sender_info} (ID: `{sender_id}`){group_line}"
+        
+        # Wait for the earlier delivery if it is still queued, to reply to it
+        def send(future: asyncio.Future):
+            if future.result() is None:
+                fallback()
+                return
+            metrics.MEDIA_DEDUPLICATED.labels(media_type).inc()
+            self.outbound.send_message(
+                self.owner_id, text, idempotency_key=f"{key}:repeat", reply_to_message_id=future.result()
+            )
+        
+        earlier.add_done_callback(send)
+    
+    def _copy_to_owner(self, message: Message, title: str, sender_info: str, sender_id: int,
+                       key: str) -> Optional[asyncio.Future]:
+        """Send header and content to the owner as a single message.
+        
+        Text is re-sent with the header prepended; captionable media is
+        re-sent by file_id with the header merged into its caption. Returns
+        the delivery's future, or None when the message can't be delivered
+        this way (stickers, polls, service messages, or content that would
+        exceed Telegram's limits).
+        """
+        lines = []
+        if message.chat.type != enums.ChatType.PRIVATE:
+            lines.append([(f"Group: {message.chat.title}", False)])
+        lines.append([(f"From: {sender_info} (ID: ", False), (str(sender_id), True), (")", False)])
+        lines.append([(f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", False)])
+        header, entities = build_header(title, lines)
+        offset = utf16_len(header)
+        
+        if message.text:
+            if offset + utf16_len(message.text) > MAX_TEXT_LENGTH:
+                return None
+            return self.outbound.send_message(
+                self.owner_id,
+                header + message.text,
+                idempotency_key=f"{key}:copy",
+                entities=entities + shift_entities(message.entities, offset),
+                parse_mode=enums.ParseMode.DISABLED
+            )
+        
+        media = message.media.value if message.media in COPYABLE_MEDIA else None
+        if media is None:
+            return None
+        caption = message.caption or ""
+        if offset + utf16_len(caption) > MAX_CAPTION_LENGTH:
+            return None
+        return self.outbound.submit(
+            "send_cached_media",
+            idempotency_key=f"{key}:copy",
+            chat_id=self.owner_id,
+            file_id=getattr(message, media).file_id,
+            caption=header + caption,
+            caption_entities=entities + shift_entities(message.caption_entities, offset),
+            parse_mode=enums.ParseMode.DISABLED
+        )
     
     async def _handle_bot_mention(self, message: Message):
         """Handle when bot is mentioned in a group"""
         try:
-            offline_msg = self.settings.get_offline_message()
-            await message.reply_text(offline_msg)
+            sender_id, sender_info = await self.profiles.resolve_sender(message)
+            if self.cooldowns.should_reply(message.chat.id, sender_id):
+                offline_msg = self.settings.get_offline_message()
+                self.outbound.reply(message, offline_msg)
             
             if self.settings.get("forward_messages"):
-                await self._forward_bot_mention_to_owner(message)
+                await self._forward_bot_mention_to_owner(message, sender_id, sender_info)
             
-            logger.info(f"Bot mentioned in group {message.chat.id} by {message.from_user.id}")
+            logger.info(
+                "Bot mentioned in group %s by %s", message.chat.id, sender_id,
+                extra={"handler": "bot_mention", "sender_id": sender_id, "chat_id": message.chat.id}
+            )
         except Exception as e:
-            logger.error(f"Error handling bot mention: {e}")
+            logger.error("Error handling bot mention: %s", e)
     
-    async def _forward_bot_mention_to_owner(self, message: Message):
+    async def _forward_bot_mention_to_owner(self, message: Message, sender_id: int, sender_info: str):
         """Forward bot mention notification to owner"""
-        sender_info = self._get_sender_info(message.from_user)
-        
-        notification = (
-            f"🏷️ **Bot Mentioned in Group**\n"
-            f"Group: {message.chat.title}\n"
-            f"From: {sender_info} (ID: `{message.from_user.id}`)\n"
-            f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-            f"{'─' * 30}\n"
-        )
-        await self.app.send_message(Config.OWNER_ID, notification)
-        await message.forward(Config.OWNER_ID)
+        self._notify_owner(message, "bot_mention", "🏷️", "Bot Mentioned in Group", sender_info, sender_id)
     
     async def _handle_owner_mention(self, message: Message):
         """Handle when owner is mentioned or replied to in a group"""
@@ -327,72 +1042,192 @@ class CrushBot:
             return
         
         try:
-            sender_info = self._get_sender_info(message.from_user)
+            sender_id, sender_info = await self.profiles.resolve_sender(message)
+            self._notify_owner(
+                message, "owner_mention", "💬", "Someone is trying to reach you!", sender_info, sender_id
+            )
             
-            notification = (
-                f"💬 **Someone is trying to reach you!**\n"
-                f"Group: {message.chat.title}\n"
-                f"From: {sender_info} (ID: `{message.from_user.id}`)\n"
-                f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"{'─' * 30}\n"
+            logger.info(
+                "Owner mentioned in group %s by %s", message.chat.id, sender_id,
+                extra={"handler": "owner_mention", "sender_id": sender_id, "chat_id": message.chat.id}
+            )
+        except Exception as e:
+            logger.error("Error notifying owner: %s", e)
+    
+    async def _handle_watch_match(self, message: Message, hits):
+        """Notify the owner of a group message that matched the watchlist"""
+        if not self.settings.get("direct_message_alerts"):
+            return
+        
+        try:
+            sender_id, sender_info = await self.profiles.resolve_sender(message)
+            self._notify_owner(
+                message, "watch", "👀", f"Watchlist match: {', '.join(hits)}", sender_info, sender_id
             )
-            await self.app.send_message(Config.OWNER_ID, notification)
-            await message.forward(Config.OWNER_ID)
             
-            logger.info(f"Owner mentioned in group {message.chat.id} by {message.from_user.id}")
+            logger.info(
+                "Watchlist match in group %s by %s", message.chat.id, sender_id,
+                extra={"handler": "watch", "sender_id": sender_id, "chat_id": message.chat.id}
+            )
         except Exception as e:
-            logger.error(f"Error notifying owner: {e}")
+            logger.error("Error notifying owner of watchlist match: %s", e)
     
     def _is_owner_reply(self, message: Message):
         """Check if message is a reply to owner"""
-        return (message.reply_to_message and 
-                message.reply_to_message.from_user.id == Config.OWNER_ID)
+        reply = message.reply_to_message
+        if reply is not None and (reply.from_user or reply.sender_chat):
+            return bool(reply.from_user and reply.from_user.id == self.owner_id)
+        # Telegram sometimes omits the replied-to message; fall back to who we saw write it
+        reply_id = message.reply_to_message_id or (reply.id if reply else None)
+        return bool(reply_id and self.profiles.author_of(message.chat.id, reply_id) == self.owner_id)
     
-    async def handle_group_message(self, message: Message):
-        """Handle messages in groups"""
+    def _record_group_activity(self, message: Message):
+        """Count a relevant group message for /report"""
+        sender_id, sender_info = self.profiles.sender(message)
+        self.activity.record("group", sender_id, sender_info, message.chat.id, self.profiles.chat_label(message.chat))
+    
+    async def handle_group_message(self, message: Message, mentions=None, hits=None):
+        """Handle messages in groups that passed the relevance filter.
+        
+        Shard workers pass in the mentions and watchlist hits they found.
+        """
         try:
-            if not self.settings.is_enabled():
-                return
-            
-            if message.from_user.id == Config.OWNER_ID:
-                return
+            self._record_group_activity(message)
+            if self.settings.get("archive_messages"):
+                self.archive.record(message, "group", self.tenant.name)
             
-            bot_me = await self.app.get_me()
-            mentioned_bot, mentioned_owner = self._check_mentions(message, bot_me.username)
+            mentioned_bot, mentioned_owner = mentions or self._check_mentions(message, self.bot_username)
             
             if mentioned_bot:
                 await self._handle_bot_mention(message)
             
             if mentioned_owner or self._is_owner_reply(message):
                 await self._handle_owner_mention(message)
+            else:
+                if hits is None:
+                    hits = self.watchlist.match(message.text or message.caption)
+                if hits:
+                    await self._handle_watch_match(message, hits)
         
         except Exception as e:
-            logger.error(f"Error handling group message: {e}")
+            logger.error("Error handling group message: %s", e)
+    
+    async def start(self):
+        """Warm up and start the client and background services.
+        
+        Saved caches, the archive and the outbox load while the client
+        connects; then the identity Pyrogram fetched during its own start is
+        taken over and pending deliveries are replayed. Updates arriving in
+        the meantime wait in the handler filters and paused lanes, so a
+        backlog after a restart is only handled once everything is warm.
+        """
+        started = time.perf_counter()
+        self.stopping.clear()
+        if not self._hosted:
+            metrics.clear_ready()
+        self.dispatcher.start(paused=True)
+        if self.shards is not None:
+            # Worker processes boot while the rest warms up
+            self.shards.start()
+        loop = asyncio.get_running_loop()
+        warmups = [
+            self.app.start(),
+            loop.run_in_executor(None, self.cooldowns.load),
+            loop.run_in_executor(None, self.media_index.load),
+        ]
+        if not self._hosted:
+            warmups += [self.archive.start(), self.outbox.start(), self.metrics_server.start()]
+        await asyncio.gather(*warmups)
+        
+        self._set_identity(getattr(self.app, "me", None) or await metrics.api_call(self.app, "get_me"))
+        await self.outbound.replay()
+        self._persist_task = asyncio.ensure_future(self._persist_cooldowns())
+        self._sweep_task = asyncio.ensure_future(self._sweep_flood_guard())
+        
+        self.dispatcher.resume()
+        self.ready.set()
+        elapsed = time.perf_counter() - started
+        metrics.STARTUP_SECONDS.labels(self.tenant.name).set(round(elapsed, 3))
+        logger.info("CrushBot ready in %.2fs%s", elapsed, f" for tenant {self.tenant.name}" if self.tenant.name else "")
+        if not self._hosted:
+            metrics.mark_ready()
+    
+    async def stop(self):
+        """Flush pending work and stop the client and background services.
+        
+        The client keeps receiving updates until its own stop at the end;
+        the filters drop them from here on rather than wait for readiness,
+        which would keep Pyrogram's handler workers, and so the stop, busy.
+        """
+        self.stopping.set()
+        self.ready.clear()
+        if not self._hosted:
+            metrics.clear_ready()
+        if self.shards is not None:
+            await self.shards.stop(timeout=10)
+        await self.dispatcher.stop(timeout=10)
+        self._persist_task.cancel()
+        self._sweep_task.cancel()
+        await asyncio.gather(self.cooldowns.save(), self.media_index.save())
+        await self.settings.flush()
+        self.digest.flush()
+        await self.outbound.drain(timeout=10)
+        await self.app.stop()
+        if not self._hosted:
+            await self.archive.close()
+            await self.outbox.close()
+            await self.metrics_server.stop()
+    
+    async def _main(self):
+        """Start, idle until stopped, then shut down cleanly"""
+        await self.start()
+        try:
+            await idle()
+        finally:
+            await self.stop()
+    
+    async def _persist_cooldowns(self):
+        """Periodically save auto-reply cooldowns and the forwarded media index"""
+        while True:
+            await asyncio.sleep(Config.COOLDOWN_SAVE_INTERVAL)
+            await asyncio.gather(self.cooldowns.save(), self.media_index.save())
+    
+    async def _sweep_flood_guard(self):
+        """Periodically end finished mutes and forget idle senders"""
+        while True:
+            await asyncio.sleep(Config.FLOOD_SWEEP_INTERVAL)
+            self.flood_guard.sweep()
     
     def run(self):
         """Start the bot"""
         try:
             logger.info("Starting CrushBot...")
-            self.app.run()
+            self.app.run(self._main())
         except KeyboardInterrupt:
             logger.info("Bot stopped by user")
         except Exception as e:
-            logger.error(f"Critical error: {e}")
+            logger.error("Critical error: %s", e)
             raise
 
 
 def main():
     """Main entry point"""
+    Config.load_environment()
+    setup_logging()
     try:
+        if Config.TENANTS_DIR:
+            from host import TenantHost
+            TenantHost(Tenant.load_directory(Config.TENANTS_DIR)).run()
+            return
         bot = CrushBot()
         bot.run()
     except ValueError as e:
-        logger.error(f"Configuration error: {e}")
+        logger.error("Configuration error: %s", e)
         print(f"\n❌ Configuration Error: {e}")
         print("\nPlease check your .env file and ensure all required variables are set.")
         print("Required variables: API_ID, API_HASH, BOT_TOKEN, OWNER_ID")
     except Exception as e:
-        logger.error(f"Failed to start bot: {e}")
+        logger.error("Failed to start bot: %s", e)
         print(f"\n❌ Error: {e}")
 
 
@@ -0,0 +1,88 @@
+"""
+Bounded in-memory caches for CrushBot
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator, List, Optional, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire after a TTL.
+    
+    Expiry uses wall-clock time so entries can be saved and restored
+    across restarts with dump() / load().
+    """
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a live entry and mark it as recently used"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires <= time.time():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store an entry, evicting the least recently used one when full"""
+        self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry and return its value"""
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+    
+    def clear(self):
+        """Remove all entries"""
+        self._data.clear()
+    
+    def purge(self) -> int:
+        """Drop expired entries and return how many were removed"""
+        now = time.time()
+        expired = [key for key, (expires, _) in self._data.items() if expires <= now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+    
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        """Iterate over live entries, oldest first"""
+        now = time.time()
+        for key, (expires, value) in list(self._data.items()):
+            if expires > now:
+                yield key, value
+    
+    def dump(self) -> List[list]:
+        """Serialize live entries as [key, expires, value] lists"""
+        now = time.time()
+        return [[key, expires, value] for key, (expires, value) in self._data.items() if expires > now]
+    
+    def load(self, entries: List[list], key_type=None):
+        """Restore entries produced by dump(), skipping expired ones"""
+        now = time.time()
+        for key, expires, value in entries:
+            if expires <= now:
+                continue
+            if key_type is not None:
+                key = key_type(key)
+            self._data[key] = (expires, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
@@ -3,41 +3,216 @@ Configuration management for CrushBot
 """
 import os
 import json
-from typing import Dict, Any
+import asyncio
+import logging
+import tempfile
+import threading
+from typing import Dict, Any, Callable, List, Optional, Tuple
 from pathlib import Path
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Config attributes read from the environment: name -> (default, cast)
+_ENVIRONMENT: Dict[str, Tuple[Any, Optional[Callable]]] = {}
+
+
+def _env(name: str, default: Any = None, cast: Callable = None) -> Any:
+    """Read an environment variable and register it for Config.load_environment()"""
+    _ENVIRONMENT[name] = (default, cast)
+    value = os.environ.get(name, default)
+    return cast(value) if cast is not None and value is not None else value
+
+
+def write_json_atomic(path: str, data: Any, **dump_options):
+    """Write JSON to a temporary file, fsync it and move it over path.
+    
+    A crash mid-write leaves the previous file in place instead of a
+    truncated one. Blocking: call it from a worker thread on the event loop.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, **dump_options)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
 
 class Config:
     """Configuration class for bot settings"""
     
     # Telegram API credentials
-    API_ID = os.getenv("API_ID")
-    API_HASH = os.getenv("API_HASH")
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
-    OWNER_ID = int(os.getenv("OWNER_ID", 0))
+    API_ID = _env("API_ID")
+    API_HASH = _env("API_HASH")
+    BOT_TOKEN = _env("BOT_TOKEN")
+    OWNER_ID = _env("OWNER_ID", 0, int)
     
     # Bot settings file
     SETTINGS_FILE = "bot_settings.json"
     
+    # Multi-tenant hosting: a directory with one <name>.json per tenant
+    # ({"bot_token": ..., "owner_id": ...}). When set, BOT_TOKEN and
+    # OWNER_ID are not used. Each tenant keeps its session, settings and
+    # cooldowns in <TENANTS_DIR>/<name>/.
+    TENANTS_DIR = _env("TENANTS_DIR", "")
+    # Handlers only enqueue, so hosted clients need few update workers
+    TENANT_CLIENT_WORKERS = 2
+    
+    # Logging: LOG_FORMAT is "text" or "json"; files rotate by size unless
+    # LOG_ROTATE_WHEN (e.g. "midnight", "H") selects time-based rotation
+    LOG_FILE = _env("LOG_FILE", "crushbot.log")
+    LOG_LEVEL = _env("LOG_LEVEL", "INFO", str.upper)
+    LOG_FORMAT = _env("LOG_FORMAT", "text", str.lower)
+    LOG_MAX_BYTES = _env("LOG_MAX_BYTES", 10 * 1024 * 1024, int)
+    LOG_BACKUP_COUNT = _env("LOG_BACKUP_COUNT", 5, int)
+    LOG_ROTATE_WHEN = _env("LOG_ROTATE_WHEN", "")
+    
+    # Outbound rate limits (messages per second), matching Telegram's bot limits
+    OUTBOUND_GLOBAL_RATE = _env("OUTBOUND_GLOBAL_RATE", 30, float)
+    OUTBOUND_PRIVATE_RATE = _env("OUTBOUND_PRIVATE_RATE", 1, float)
+    OUTBOUND_PRIVATE_BURST = 3
+    OUTBOUND_GROUP_RATE = _env("OUTBOUND_GROUP_RATE", 20 / 60, float)
+    OUTBOUND_GROUP_BURST = 5
+    OUTBOUND_MAX_RETRIES = 5
+    # Per-chat limiters outlive their chat's queue; beyond this many, idle
+    # ones are dropped once they have refilled
+    OUTBOUND_MAX_BUCKETS = 10000
+    
+    # Auto-reply cooldown cache
+    COOLDOWN_FILE = "reply_cooldowns.json"
+    COOLDOWN_CACHE_SIZE = 10000
+    COOLDOWN_SAVE_INTERVAL = 300
+    
+    # Index of media already forwarded to the owner (saved with the cooldowns)
+    MEDIA_INDEX_FILE = "media_index.json"
+    MEDIA_INDEX_SIZE = 5000
+    
+    # Local message archive
+    ARCHIVE_FILE = "crushbot_archive.db"
+    ARCHIVE_BATCH_SIZE = 200
+    ARCHIVE_FLUSH_INTERVAL = 2.0
+    
+    # Update dispatch lanes: workers and queue size per lane. When the DM
+    # or group lane is full, DISPATCH_SHED_POLICY decides what happens to
+    # new updates: "drop", "sample" (keep 1 in DISPATCH_SAMPLE_RATE) or
+    # "digest" (skip the auto-reply and put the message in the digest).
+    # The owner lane always waits for room instead of shedding.
+    DISPATCH_OWNER_WORKERS = 2
+    DISPATCH_OWNER_QUEUE = 100
+    DISPATCH_DM_WORKERS = _env("DISPATCH_DM_WORKERS", 8, int)
+    DISPATCH_DM_QUEUE = _env("DISPATCH_DM_QUEUE", 1000, int)
+    DISPATCH_GROUP_WORKERS = _env("DISPATCH_GROUP_WORKERS", 4, int)
+    DISPATCH_GROUP_QUEUE = _env("DISPATCH_GROUP_QUEUE", 1000, int)
+    DISPATCH_SHED_POLICY = _env("DISPATCH_SHED_POLICY", "digest", str.lower)
+    DISPATCH_SAMPLE_RATE = 10
+    
+    # Flood guard bookkeeping: tracked keys are capped, and idle ones are
+    # evicted (and finished mutes reported) every FLOOD_SWEEP_INTERVAL seconds
+    FLOOD_MAX_KEYS = 50000
+    FLOOD_SWEEP_INTERVAL = 60
+    
+    # Optional group sharding: with SHARD_WORKERS > 0, mention parsing and
+    # watchlist matching for group messages run on that many worker
+    # processes. Past SHARD_MAX_PENDING unclassified messages the bot
+    # classifies in-process instead of queueing more.
+    SHARD_WORKERS = _env("SHARD_WORKERS", 0, int)
+    SHARD_MAX_PENDING = 10000
+    # Workers are checked this often; one that died or has held a message
+    # for more than SHARD_TIMEOUT seconds is replaced, and its messages are
+    # classified in-process
+    SHARD_CHECK_INTERVAL = 1
+    SHARD_TIMEOUT = 10
+    
+    # Sender and chat profile cache; label lookups that miss are collected
+    # for PROFILE_BATCH_DELAY seconds and resolved with one get_users call
+    PROFILE_CACHE_SIZE = 20000
+    PROFILE_TTL = 6 * 3600
+    PROFILE_BATCH_DELAY = 0.05
+    
+    # Activity counters behind /report: the most recently active senders
+    # and groups tracked, and how many rows each report table shows
+    ACTIVITY_MAX_SENDERS = 20000
+    ACTIVITY_MAX_GROUPS = 5000
+    REPORT_TOP_N = 10
+    
+    # Durable outbox for owner deliveries; delivered keys are kept this
+    # many seconds so redelivered updates are not forwarded twice
+    OUTBOX_FILE = "crushbot_outbox.db"
+    OUTBOX_RETENTION = 24 * 3600
+    # Pause before retrying a batch that could not be written
+    OUTBOX_RETRY_DELAY = 5
+    
+    # Local Prometheus-text metrics endpoint; 0 disables it. It also
+    # answers GET /healthz with 200 once the bot is ready and 503 before.
+    METRICS_HOST = _env("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = _env("METRICS_PORT", 0, int)
+    
+    # Readiness file for supervisors: created once startup has finished and
+    # removed on shutdown. Empty disables it.
+    READY_FILE = _env("READY_FILE", "")
+    
+    # Delay used to coalesce consecutive settings changes into one write
+    SETTINGS_FLUSH_DELAY = 0.5
+    # Pause before retrying a settings write that failed
+    SETTINGS_RETRY_DELAY = 5
+    
     # Default settings
     DEFAULT_SETTINGS = {
         "bot_enabled": True,
         "offline_notification": True,
         "forward_messages": True,
         "direct_message_alerts": True,
-        "offline_message": "🤖 The user is currently offline. Your message has been forwarded to them."
+        "forward_mode": "copy",
+        "offline_message": "🤖 The user is currently offline. Your message has been forwarded to them.",
+        "digest_mode": False,
+        "digest_window": 60,
+        "digest_max_events": 25,
+        "auto_reply_cooldown": 300,
+        "persist_cooldowns": True,
+        "archive_messages": True,
+        "watchlist": {"keywords": [], "patterns": []},
+        "flood_guard": True,
+        "flood_window": 30,
+        "flood_sender_limit": 10,
+        "flood_chat_limit": 30,
+        "flood_mute_duration": 600,
+        "media_dedup_windows": {
+            "photo": 86400,
+            "video": 86400,
+            "animation": 86400,
+            "document": 86400,
+            "audio": 86400,
+            "sticker": 3600,
+            "voice": 0,
+            "video_note": 0
+        }
     }
     
     @classmethod
-    def validate(cls) -> bool:
-        """Validate required configuration"""
-        if not cls.API_ID or not cls.API_HASH or not cls.BOT_TOKEN:
+    def load_environment(cls, dotenv_path: str = None):
+        """Load .env and re-read every environment-backed setting.
+        
+        Called once by the entry point rather than at import time, so
+        importing this module stays cheap and free of file I/O. Variables
+        already set in the process environment win over .env.
+        """
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path)
+        for name, (default, cast) in _ENVIRONMENT.items():
+            setattr(cls, name, _env(name, default, cast))
+    
+    @classmethod
+    def validate(cls, tenant: "Tenant" = None) -> bool:
+        """Validate required configuration, for a hosted tenant if given"""
+        bot_token = tenant.bot_token if tenant else cls.BOT_TOKEN
+        owner_id = tenant.owner_id if tenant else cls.OWNER_ID
+        if not cls.API_ID or not cls.API_HASH or not bot_token:
             return False
-        if not cls.OWNER_ID or cls.OWNER_ID == 0:
+        if not owner_id or owner_id == 0:
             return False
         return True
     
@@ -47,54 +222,167 @@ class Config:
         return ["API_ID", "API_HASH", "BOT_TOKEN", "OWNER_ID"]
 
 
+class Tenant:
+    """One hosted bot token and its owner"""
+    
+    def __init__(self, name: str, bot_token: str, owner_id: int, data_dir: str = ""):
+        self.name = name
+        self.bot_token = bot_token
+        self.owner_id = int(owner_id or 0)
+        self.data_dir = data_dir
+    
+    def path(self, filename: str) -> str:
+        """Location of a per-tenant file"""
+        return os.path.join(self.data_dir, filename) if self.data_dir else filename
+    
+    @classmethod
+    def default(cls) -> "Tenant":
+        """The single tenant described by BOT_TOKEN and OWNER_ID"""
+        return cls("", Config.BOT_TOKEN, Config.OWNER_ID)
+    
+    @classmethod
+    def load_directory(cls, directory: str) -> List["Tenant"]:
+        """Load every <name>.json tenant definition in a directory"""
+        tenants = []
+        for path in sorted(Path(directory).glob("*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                data_dir = Path(directory) / path.stem
+                data_dir.mkdir(exist_ok=True)
+                tenants.append(cls(path.stem, data.get("bot_token"), data.get("owner_id"), str(data_dir)))
+            except Exception as e:
+                logger.error("Error loading tenant %s: %s", path.name, e)
+        return tenants
+
+
 class Settings:
-    """Manage bot runtime settings"""
+    """Manage bot runtime settings
+    
+    Reads are plain dict lookups. Changes are written behind: consecutive
+    set() calls are coalesced and flushed on a worker thread with an atomic
+    replace, so the event loop never waits on disk. A failed write is
+    retried every SETTINGS_RETRY_DELAY seconds; await flush() to know
+    whether a change has reached disk.
+    """
     
     def __init__(self, config_file: str = None):
         self.config_file = config_file or Config.SETTINGS_FILE
         self._settings = self._load_settings()
+        
+        # Every change bumps _version; a write only lands if it is newer
+        # than what is already on disk
+        self._version = 0
+        self._saved_version = 0
+        self._write_lock = threading.Lock()
+        self._flush_handle = None
+        self._flush_future = None
     
     def _load_settings(self) -> Dict[str, Any]:
         """Load settings from file or create default"""
         if Path(self.config_file).exists():
             try:
                 with open(self.config_file, 'r') as f:
-                    return json.load(f)
+                    # Defaults first so settings added in newer versions are present
+                    return {**Config.DEFAULT_SETTINGS, **json.load(f)}
             except Exception as e:
-                print(f"Error loading settings: {e}")
+                logger.error("Error loading settings: %s", e)
                 return Config.DEFAULT_SETTINGS.copy()
         return Config.DEFAULT_SETTINGS.copy()
     
+    @property
+    def settings(self) -> Dict[str, Any]:
+        """Snapshot of all current settings"""
+        return dict(self._settings)
+    
+    def _write(self, snapshot: Dict[str, Any], version: int):
+        """Atomically write a settings snapshot unless a newer one is on disk"""
+        with self._write_lock:
+            if version <= self._saved_version:
+                return
+            write_json_atomic(self.config_file, snapshot, indent=4)
+            self._saved_version = version
+    
     def save_settings(self) -> bool:
-        """Save current settings to file"""
+        """Save current settings to file, blocking until written"""
+        try:
+            self._write(dict(self._settings), self._version)
+            return True
+        except Exception as e:
+            logger.error("Error saving settings: %s", e)
+            return False
+    
+    def _schedule_flush(self, delay: float = None):
+        """Arrange for pending changes to be written in the background"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (e.g. scripts): write synchronously
+            self.save_settings()
+            return
+        if self._flush_handle is None and self._flush_future is None:
+            self._flush_handle = loop.call_later(
+                Config.SETTINGS_FLUSH_DELAY if delay is None else delay, self._start_flush
+            )
+    
+    def _start_flush(self):
+        """Hand the latest snapshot to a worker thread"""
+        self._flush_handle = None
+        loop = asyncio.get_running_loop()
+        self._flush_future = loop.run_in_executor(
+            None, self._write, dict(self._settings), self._version
+        )
+        self._flush_future.add_done_callback(self._flush_done)
+    
+    def _flush_done(self, future):
+        """Report write errors and pick up changes made during the write"""
+        self._flush_future = None
+        if future.exception():
+            logger.error("Error saving settings, retrying in %ss: %s", Config.SETTINGS_RETRY_DELAY, future.exception())
+            self._schedule_flush(Config.SETTINGS_RETRY_DELAY)
+            return
+        if self._saved_version < self._version:
+            self._schedule_flush()
+    
+    async def flush(self) -> bool:
+        """Write any pending changes now and wait for them to reach disk"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_future is not None:
+            await asyncio.wait([self._flush_future])
+        if self._saved_version >= self._version:
+            return True
+        loop = asyncio.get_running_loop()
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self._settings, f, indent=4)
+            await loop.run_in_executor(None, self._write, dict(self._settings), self._version)
             return True
         except Exception as e:
-            print(f"Error saving settings: {e}")
+            logger.error("Error saving settings, retrying in %ss: %s", Config.SETTINGS_RETRY_DELAY, e)
+            self._schedule_flush(Config.SETTINGS_RETRY_DELAY)
             return False
     
     def get(self, key: str, default: Any = None) -> Any:
         """Get a setting value"""
         return self._settings.get(key, default)
     
-    def set(self, key: str, value: Any) -> bool:
-        """Set a setting value and save"""
+    def set(self, key: str, value: Any):
+        """Set a setting value and schedule a save (see flush())"""
         self._settings[key] = value
-        return self.save_settings()
+        self._version += 1
+        self._schedule_flush()
     
     def is_enabled(self) -> bool:
         """Check if bot is enabled"""
         return self._settings.get("bot_enabled", True)
     
-    def enable(self) -> bool:
+    def enable(self):
         """Enable the bot"""
-        return self.set("bot_enabled", True)
+        self.set("bot_enabled", True)
     
-    def disable(self) -> bool:
+    def disable(self):
         """Disable the bot"""
-        return self.set("bot_enabled", False)
+        self.set("bot_enabled", False)
     
     def get_offline_message(self) -> str:
         """Get the offline notification message"""
@@ -0,0 +1,70 @@
+"""
+Per-sender auto-reply cooldown for CrushBot
+"""
+import asyncio
+import json
+import logging
+import time
+from pathlib import Path
+
+from cache import TTLCache
+from config import Config, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class ReplyCooldown:
+    """Remember who received the offline reply so it is sent once per window"""
+    
+    def __init__(self, settings, path: str = None, maxsize: int = None):
+        self.settings = settings
+        self.path = path or Config.COOLDOWN_FILE
+        self._cache = TTLCache(maxsize or Config.COOLDOWN_CACHE_SIZE, self.window)
+    
+    @property
+    def window(self) -> int:
+        """Cooldown window in seconds (0 disables the cooldown)"""
+        return self.settings.get("auto_reply_cooldown")
+    
+    def should_reply(self, chat_id: int, sender_id: int) -> bool:
+        """Return True and start a cooldown if this sender may get a reply now"""
+        window = self.window
+        if window <= 0:
+            return True
+        
+        key = (chat_id, sender_id)
+        now = time.time()
+        last = self._cache.get(key)
+        if last is not None and now - last < window:
+            return False
+        
+        self._cache.set(key, now, ttl=window)
+        return True
+    
+    def clear(self):
+        """Forget all cooldowns"""
+        self._cache.clear()
+    
+    def load(self):
+        """Restore cooldowns saved by a previous run"""
+        if not self.settings.get("persist_cooldowns") or not Path(self.path).exists():
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self._cache.load(json.load(f), key_type=tuple)
+            logger.info("Restored %s auto-reply cooldowns", len(self._cache))
+        except Exception as e:
+            logger.error("Error loading cooldowns: %s", e)
+    
+    async def save(self) -> bool:
+        """Save active cooldowns so a restart doesn't re-send replies"""
+        if not self.settings.get("persist_cooldowns"):
+            return True
+        # Snapshot on the event loop, write atomically on a worker thread
+        entries = self._cache.dump()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_json_atomic, self.path, entries)
+            return True
+        except Exception as e:
+            logger.error("Error saving cooldowns: %s", e)
+            return False
@@ -0,0 +1,146 @@
+"""
+Digest mode for CrushBot: batch owner notifications into periodic summaries
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pyrogram.types import Message
+
+from formatting import MAX_TEXT_LENGTH
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts at most 100 message IDs per forward_messages call
+FORWARD_BATCH_LIMIT = 100
+
+KIND_ICONS = {
+    "dm": "📨",
+    "bot_mention": "🏷️",
+    "owner_mention": "💬",
+    "watch": "👀",
+}
+
+
+class DigestEvent:
+    """A buffered message waiting to be delivered in the next digest"""
+    
+    __slots__ = ("kind", "chat_id", "chat_title", "sender_info", "sender_id", "message_id", "time", "held")
+    
+    def __init__(self, kind: str, message: Message, sender_info: str, sender_id: int):
+        self.kind = kind
+        self.chat_id = message.chat.id
+        self.chat_title = message.chat.title
+        self.sender_info = sender_info
+        self.sender_id = sender_id
+        self.message_id = message.id
+        self.time = datetime.now()
+        # Outbox key of the plain forward that stands in for this event until it is flushed
+        self.held: Optional[str] = None
+    
+    def summary_line(self) -> str:
+        """One-line description used in the digest header"""
+        line = f"{KIND_ICONS.get(self.kind, '•')} {self.time.strftime('%H:%M:%S')} {self.sender_info} (ID: `{self.sender_id}`)"
+        if self.chat_title:
+            line += f" in {self.chat_title}"
+        return line
+
+
+class DigestBuffer:
+    """Buffer owner notifications and flush them as one digest.
+    
+    A flush happens when the configured window elapses after the first
+    buffered event, or as soon as the configured event count is reached.
+    Each flush sends one summary header and one bulk forward per source chat.
+    
+    While buffered, every event is also held in the outbox as a plain
+    forward, released once its digest is queued, so a crash before the
+    flush still delivers it (without the summary) on the next start.
+    """
+    
+    def __init__(self, outbound, owner_id: int, settings):
+        self.outbound = outbound
+        self.owner_id = owner_id
+        self.settings = settings
+        self._events: List[DigestEvent] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes = 0
+    
+    def __len__(self) -> int:
+        return len(self._events)
+    
+    def add(self, kind: str, message: Message, sender_info: str, sender_id: int):
+        """Buffer a message for the next digest"""
+        event = DigestEvent(kind, message, sender_info, sender_id)
+        event.held = self.outbound.hold(
+            "forward_messages", f"digest:{event.chat_id}:{event.message_id}:{kind}:held",
+            chat_id=self.owner_id, from_chat_id=event.chat_id, message_ids=event.message_id
+        )
+        self._events.append(event)
+        
+        if len(self._events) >= self.settings.get("digest_max_events"):
+            self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_event_loop()
+            self._timer = loop.call_later(self.settings.get("digest_window"), self.flush)
+    
+    def flush(self):
+        """Queue the buffered events for delivery to the owner"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        
+        events, self._events = self._events, []
+        if not events:
+            return
+        
+        # Outbox keys derive from the first buffered message plus the flush
+        # time and count: consecutive digests can start with the same
+        # message (e.g. one that is both a bot and an owner mention)
+        self._flushes += 1
+        first = events[0]
+        key = f"digest:{first.chat_id}:{first.message_id}:{first.kind}:{time.time_ns()}.{self._flushes}"
+        for part, text in enumerate(self._build_headers(events)):
+            self.outbound.send_message(self.owner_id, text, idempotency_key=f"{key}:header:{part}")
+        
+        # One bulk forward per source chat, preserving arrival order; a
+        # message buffered under several kinds is forwarded once
+        by_chat: Dict[int, Dict[int, None]] = {}
+        for event in events:
+            by_chat.setdefault(event.chat_id, {})[event.message_id] = None
+        
+        for chat_id, unique_ids in by_chat.items():
+            message_ids = list(unique_ids)
+            for start in range(0, len(message_ids), FORWARD_BATCH_LIMIT):
+                self.outbound.submit(
+                    "forward_messages",
+                    idempotency_key=f"{key}:{chat_id}:{start}",
+                    chat_id=self.owner_id,
+                    from_chat_id=chat_id,
+                    message_ids=message_ids[start:start + FORWARD_BATCH_LIMIT]
+                )
+        
+        # The digest's own deliveries are in the outbox now, in the same or an earlier batch
+        for event in events:
+            self.outbound.release(event.held)
+        
+        logger.info("Flushed digest of %s messages from %s chats", len(events), len(by_chat))
+    
+    def _build_headers(self, events: List[DigestEvent]) -> List[str]:
+        """Render the summary, split to fit Telegram's message length limit"""
+        texts = []
+        current = (
+            f"🗞️ **Digest** ({len(events)} messages)\n"
+            f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"{'─' * 30}\n"
+        )
+        for event in events:
+            line = event.summary_line() + "\n"
+            if len(current) + len(line) > MAX_TEXT_LENGTH:
+                texts.append(current)
+                current = ""
+            current += line
+        texts.append(current)
+        return texts
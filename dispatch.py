@@ -0,0 +1,165 @@
+"""
+Prioritised update dispatch for CrushBot
+"""
+import asyncio
+import functools
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# What a full lane does with a new update
+SHED_POLICIES = ("block", "drop", "sample", "digest")
+
+
+class Lane:
+    """A bounded queue of updates served by its own pool of workers"""
+    
+    def __init__(self, name: str, workers: int, maxsize: int, policy: str = "block",
+                 overflow: Callable = None, sample_rate: int = None):
+        if policy not in SHED_POLICIES:
+            raise ValueError(f"Unknown shed policy {policy!r} for lane {name}")
+        if policy == "digest" and overflow is None:
+            raise ValueError(f"Lane {name} needs an overflow handler for the digest policy")
+        self.name = name
+        self.workers = workers
+        self.maxsize = maxsize
+        self.policy = policy
+        self.overflow = overflow
+        self.sample_rate = sample_rate or Config.DISPATCH_SAMPLE_RATE
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.shedding = False
+        self._overflowed = 0
+        self.queued = metrics.DISPATCH_QUEUED.labels(name)
+        self.shed = metrics.DISPATCH_SHED.labels(name)
+        self.latency = metrics.DISPATCH_LATENCY.labels(name)
+
+
+class UpdateDispatcher:
+    """Run handlers on separate lanes instead of Pyrogram's shared workers.
+    
+    Pyrogram handlers decorated with lane() only enqueue the update, so
+    Pyrogram's worker pool is never tied up by slow handlers. Each lane has
+    its own workers, so a flood of DMs or group traffic cannot delay owner
+    commands. When a lane's queue is full it applies its shed policy:
+    block (wait for room), drop, sample (keep one in sample_rate of the
+    overflow, evicting the oldest queued update) or digest (hand the
+    update to a cheap overflow handler, e.g. the digest buffer).
+    """
+    
+    def __init__(self):
+        self.lanes: Dict[str, Lane] = {}
+        # Set by stop(): updates arriving afterwards are dropped, since no
+        # worker would take them and a full "block" lane would never return
+        self.stopped = False
+    
+    def add_lane(self, name: str, workers: int, maxsize: int, policy: str = "block",
+                 overflow: Callable = None) -> Lane:
+        """Define a lane; lanes must be added before handlers reference them"""
+        lane = self.lanes[name] = Lane(name, workers, maxsize, policy, overflow)
+        return lane
+    
+    def lane(self, name: str):
+        """Decorate an async handler so that calling it enqueues it on a lane"""
+        lane = self.lanes[name]
+        
+        def decorator(func):
+            @functools.wraps(func)
+            async def enqueue(*args):
+                if self.stopped:
+                    logger.debug("Dropping update for lane %s after stop", lane.name)
+                    return
+                await self._put(lane, (func, args, time.perf_counter()))
+            return enqueue
+        return decorator
+    
+    async def _put(self, lane: Lane, item: tuple):
+        """Enqueue an update, applying the lane's shed policy when full"""
+        if not lane.queue.full():
+            lane.queue.put_nowait(item)
+            lane.queued.inc()
+            lane.shedding = False
+            return
+        
+        if lane.policy == "block":
+            await lane.queue.put(item)
+            lane.queued.inc()
+            return
+        
+        if not lane.shedding:
+            logger.warning("Lane %s is full (%s queued), shedding with policy %s", lane.name, lane.maxsize, lane.policy)
+            lane.shedding = True
+        lane.shed.inc()
+        
+        if lane.policy == "sample":
+            lane._overflowed += 1
+            if lane._overflowed % lane.sample_rate == 0:
+                # Make room by discarding the stalest update instead
+                lane.queue.get_nowait()
+                lane.queue.task_done()
+                lane.queue.put_nowait(item)
+        elif lane.policy == "digest":
+            _, args, _ = item
+            try:
+                lane.overflow(*args)
+            except Exception as e:
+                logger.error("Error in %s lane overflow handler: %s", lane.name, e)
+    
+    async def _worker(self, lane: Lane):
+        """Run queued handlers for a lane one at a time"""
+        while True:
+            func, args, queued_at = await lane.queue.get()
+            lane.queued.dec()
+            try:
+                await func(*args)
+            except Exception as e:
+                logger.error("Unhandled error in %s lane: %s", lane.name, e)
+            finally:
+                lane.latency.observe(time.perf_counter() - queued_at)
+                lane.queue.task_done()
+    
+    def start(self, paused: bool = False):
+        """Create the queues and start every lane's workers.
+        
+        With paused=True updates are queued but not handled until resume().
+        """
+        self.stopped = False
+        for lane in self.lanes.values():
+            lane.queue = asyncio.Queue(maxsize=lane.maxsize)
+        if not paused:
+            self.resume()
+    
+    def resume(self):
+        """Start the workers of every lane that has none running"""
+        loop = asyncio.get_event_loop()
+        for lane in self.lanes.values():
+            if not lane.tasks:
+                lane.tasks = [loop.create_task(self._worker(lane)) for _ in range(lane.workers)]
+    
+    def pending(self) -> int:
+        """Updates queued on all lanes"""
+        return sum(lane.queue.qsize() for lane in self.lanes.values() if lane.queue)
+    
+    async def drain(self, timeout: float = None):
+        """Wait until every queued update has been handled"""
+        joins = [lane.queue.join() for lane in self.lanes.values() if lane.queue]
+        if not joins:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*joins), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Gave up waiting for %s queued updates", self.pending())
+    
+    async def stop(self, timeout: float = None):
+        """Finish queued updates, then stop the workers"""
+        await self.drain(timeout)
+        self.stopped = True
+        for lane in self.lanes.values():
+            for task in lane.tasks:
+                task.cancel()
+            lane.tasks = []
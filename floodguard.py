@@ -0,0 +1,135 @@
+"""
+Sliding-window flood guard for CrushBot
+"""
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# ("user", user_id) or ("chat", chat_id)
+Key = Tuple[str, int]
+
+
+class _Mute:
+    """A temporarily silenced sender or chat"""
+    
+    __slots__ = ("label", "until", "suppressed")
+    
+    def __init__(self, label: str, until: float):
+        self.label = label
+        self.until = until
+        self.suppressed = 0
+
+
+class FloodGuard:
+    """Mute senders and chats that exceed a message rate.
+    
+    Each key keeps a ring buffer holding only its last `limit` arrival
+    times: the key is over the limit when the buffer is full and its
+    oldest entry is still inside the window. Muted keys are rejected
+    without further accounting; the owner hears about a mute once when it
+    starts and once, with a count of suppressed messages, when it ends.
+    Limits are read from Settings so they can change at runtime.
+    """
+    
+    def __init__(self, settings, notify: Callable[[str], None], max_keys: int = None):
+        self.settings = settings
+        self.notify = notify
+        self.max_keys = max_keys or Config.FLOOD_MAX_KEYS
+        self._windows: Dict[Key, deque] = {}
+        self._mutes: Dict[Key, _Mute] = {}
+    
+    def check(self, sender_id: int, sender_label: str, chat_id: int = None, chat_label: str = None) -> bool:
+        """Account for one message and return whether it may be handled.
+        
+        Pass chat_id for group messages to apply the per-chat limit as well.
+        """
+        if not self.settings.get("flood_guard"):
+            return True
+        
+        now = time.monotonic()
+        keys = [(("user", sender_id), sender_label, self.settings.get("flood_sender_limit"))]
+        if chat_id is not None:
+            keys.append((("chat", chat_id), chat_label, self.settings.get("flood_chat_limit")))
+        
+        for key, _, _ in keys:
+            mute = self._mutes.get(key)
+            if mute is not None:
+                if now < mute.until:
+                    mute.suppressed += 1
+                    metrics.FLOOD_SUPPRESSED.labels(key[0]).inc()
+                    return False
+                self._expire(key)
+        
+        window = self.settings.get("flood_window")
+        muted = [key for key, label, limit in keys if self._hit(key, now, window, limit)]
+        for key, label, limit in keys:
+            if key in muted:
+                self._mute(key, label, now, limit, window)
+        if muted:
+            metrics.FLOOD_SUPPRESSED.labels(muted[0][0]).inc()
+            return False
+        return True
+    
+    def _hit(self, key: Key, now: float, window: float, limit: int) -> bool:
+        """Record an arrival and return whether the key is over its limit"""
+        times = self._windows.get(key)
+        if times is None or times.maxlen != limit:
+            if len(self._windows) >= self.max_keys:
+                self.sweep()
+                if len(self._windows) >= self.max_keys:
+                    # Everyone is active: forget the longest-tracked key
+                    del self._windows[next(iter(self._windows))]
+            times = self._windows[key] = deque(times or (), maxlen=limit)
+        over = len(times) == limit and now - times[0] < window
+        times.append(now)
+        return over
+    
+    def _mute(self, key: Key, label: str, now: float, limit: int, window: float):
+        """Start muting a key and tell the owner"""
+        duration = self.settings.get("flood_mute_duration")
+        self._mutes[key] = _Mute(label, now + duration)
+        self._windows.pop(key, None)
+        logger.warning("Flood guard muted %s %s (%s) for %ss", key[0], key[1], label, duration)
+        self.notify(
+            f"🔇 Muted {label} (ID: `{key[1]}`) for {duration // 60} min: "
+            f"more than {limit} messages in {window}s"
+        )
+    
+    def _expire(self, key: Key, report: bool = True):
+        """End a mute and report what it suppressed"""
+        mute = self._mutes.pop(key)
+        if report and mute.suppressed:
+            self.notify(f"🔈 Unmuted {mute.label} (ID: `{key[1]}`): {mute.suppressed} messages were suppressed")
+    
+    def sweep(self):
+        """Expire finished mutes and evict keys idle for a whole window"""
+        now = time.monotonic()
+        for key in [key for key, mute in self._mutes.items() if now >= mute.until]:
+            self._expire(key)
+        window = self.settings.get("flood_window")
+        for key in [key for key, times in self._windows.items() if now - times[-1] >= window]:
+            del self._windows[key]
+    
+    def mutes(self) -> List[Tuple[Key, str, int, int]]:
+        """Active mutes as (key, label, seconds left, suppressed count)"""
+        now = time.monotonic()
+        return [
+            (key, mute.label, int(mute.until - now), mute.suppressed)
+            for key, mute in self._mutes.items() if mute.until > now
+        ]
+    
+    def unmute(self, target_id: Optional[int] = None) -> int:
+        """Lift the mute on a user or chat ID, or every mute when None"""
+        keys = [key for key in self._mutes if target_id is None or key[1] == target_id]
+        for key in keys:
+            self._expire(key, report=False)
+        return len(keys)
+    
+    def __len__(self) -> int:
+        return len(self._windows)
@@ -0,0 +1,56 @@
+"""
+Message formatting helpers for CrushBot
+"""
+from typing import List, Optional, Sequence, Tuple
+
+from pyrogram import enums
+from pyrogram.types import MessageEntity
+
+# Telegram limits, counted in UTF-16 code units like entity offsets
+MAX_TEXT_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+
+# A header line is a sequence of (text, as_code) segments
+HeaderLine = Sequence[Tuple[str, bool]]
+
+
+def utf16_len(text: str) -> int:
+    """Length of text in UTF-16 code units, the unit Telegram offsets use"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def build_header(title: str, lines: Sequence[HeaderLine]) -> Tuple[str, List[MessageEntity]]:
+    """Render a notification header as plain text plus entities.
+    
+    Using entities rather than a parse mode means sender names are never
+    misread as markup, and the header can be put in front of text that
+    carries its own entities.
+    """
+    entities = [MessageEntity(type=enums.MessageEntityType.BOLD, offset=0, length=utf16_len(title))]
+    text = title + "\n"
+    for line in lines:
+        for segment, as_code in line:
+            if as_code:
+                entities.append(MessageEntity(
+                    type=enums.MessageEntityType.CODE, offset=utf16_len(text), length=utf16_len(segment)
+                ))
+            text += segment
+        text += "\n"
+    text += f"{'─' * 30}\n"
+    return text, entities
+
+
+def shift_entities(entities: Optional[Sequence[MessageEntity]], offset: int) -> List[MessageEntity]:
+    """Copy entities moved right by offset UTF-16 code units"""
+    return [
+        MessageEntity(
+            type=entity.type,
+            offset=entity.offset + offset,
+            length=entity.length,
+            url=entity.url,
+            user=entity.user,
+            language=entity.language,
+            custom_emoji_id=entity.custom_emoji_id
+        )
+        for entity in entities or ()
+    ]
@@ -0,0 +1,91 @@
+"""
+Multi-tenant hosting: many CrushBot instances in one process
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, List
+
+from pyrogram import idle
+
+import metrics
+from archive import MessageArchive
+from bot import CrushBot
+from config import Tenant
+from outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+
+class TenantHost:
+    """Run one CrushBot per tenant on a single event loop.
+    
+    Tenants keep their own client, settings, cooldowns and queues, and
+    share the process, logging, metrics endpoint, message archive and
+    outbox. A tenant that fails to start is logged and left out rather
+    than taking the others down.
+    """
+    
+    def __init__(self, tenants: List[Tenant], client_factory: Callable = None):
+        if not tenants:
+            raise ValueError("No tenants configured")
+        self.archive = MessageArchive()
+        self.outbox = Outbox()
+        self.ready = False
+        self.metrics_server = metrics.MetricsServer(ready=lambda: self.ready)
+        self.bots: List[CrushBot] = []
+        for tenant in tenants:
+            try:
+                client = client_factory(tenant) if client_factory else None
+                self.bots.append(CrushBot(client, tenant, archive=self.archive, outbox=self.outbox))
+            except ValueError as e:
+                logger.error("Skipping tenant %s: %s", tenant.name, e)
+        if not self.bots:
+            raise ValueError("No valid tenants configured")
+    
+    async def start(self):
+        """Open shared services, then start every tenant concurrently"""
+        started = time.perf_counter()
+        metrics.clear_ready()
+        await asyncio.gather(self.archive.start(), self.outbox.start(), self.metrics_server.start())
+        results = await asyncio.gather(*(bot.start() for bot in self.bots), return_exceptions=True)
+        running = []
+        for bot, result in zip(self.bots, results):
+            if isinstance(result, Exception):
+                logger.error("Tenant %s failed to start: %s", bot.tenant.name, result)
+                # Release updates its filters may be holding until it is ready
+                bot.stopping.set()
+            else:
+                running.append(bot)
+        self.bots = running
+        self.ready = True
+        logger.info("Hosting %s tenants, ready in %.2fs", len(self.bots), time.perf_counter() - started)
+        metrics.mark_ready()
+    
+    async def stop(self):
+        """Stop every tenant, then close shared services"""
+        self.ready = False
+        metrics.clear_ready()
+        results = await asyncio.gather(*(bot.stop() for bot in self.bots), return_exceptions=True)
+        for bot, result in zip(self.bots, results):
+            if isinstance(result, Exception):
+                logger.error("Tenant %s failed to stop cleanly: %s", bot.tenant.name, result)
+        await self.archive.close()
+        await self.outbox.close()
+        await self.metrics_server.stop()
+    
+    async def _main(self):
+        """Start, idle until stopped, then shut down cleanly"""
+        await self.start()
+        try:
+            await idle()
+        finally:
+            await self.stop()
+    
+    def run(self):
+        """Run all tenants until interrupted"""
+        try:
+            logger.info("Starting CrushBot host...")
+            asyncio.get_event_loop().run_until_complete(self._main())
+        except KeyboardInterrupt:
+            logger.info("Host stopped by user")
@@ -0,0 +1,104 @@
+"""
+Logging pipeline for CrushBot
+
+Records are handed to a queue on the calling thread and formatted and
+written by a background listener thread, so logging from the event loop
+costs only an enqueue.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+from typing import Optional
+
+from config import Config
+
+# Extra fields copied into JSON log lines when a record carries them,
+# e.g. logger.info("...", extra={"sender_id": 1, "handler": "dm"})
+CONTEXT_FIELDS = ("sender_id", "chat_id", "handler", "latency_ms")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class EnqueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread.
+    
+    The stock QueueHandler renders the message in prepare() so records can
+    be pickled; an in-process queue doesn't need that, so the record is
+    passed through untouched and %-style args are only interpolated if a
+    listener handler actually emits it.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _file_handler() -> logging.Handler:
+    """Rotating file handler, by time if LOG_ROTATE_WHEN is set, else by size"""
+    if Config.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            Config.LOG_FILE,
+            when=Config.LOG_ROTATE_WHEN,
+            backupCount=Config.LOG_BACKUP_COUNT,
+            encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        Config.LOG_FILE,
+        maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT,
+        encoding="utf-8"
+    )
+
+
+def setup_logging():
+    """Route all logging through a queue drained by a background thread"""
+    global _listener
+    if _listener is not None:
+        return
+    
+    formatter = JsonFormatter() if Config.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [_file_handler(), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(Config.LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(EnqueueHandler(log_queue))
+    
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,110 @@
+"""
+Recently forwarded media index for CrushBot
+"""
+import asyncio
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from pyrogram.types import Message
+
+from cache import TTLCache
+from config import Config, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# (media type, file_unique_id)
+MediaKey = Tuple[str, str]
+
+
+class MediaIndex:
+    """Remember which media the owner already received, and where.
+    
+    Media is identified by Telegram's file_unique_id, which is the same for
+    every re-share of a file. Each entry maps it to the owner-side message
+    that delivered it and lives for its media type's window from the
+    media_dedup_windows setting; types with a window of 0 (or missing) are
+    never deduplicated. Deliveries still in flight are tracked too, so a
+    burst of the same sticker produces one forward and a row of references.
+    """
+    
+    def __init__(self, settings, path: str = None, maxsize: int = None):
+        self.settings = settings
+        self.path = path or Config.MEDIA_INDEX_FILE
+        # Every entry is stored with its media type's window as TTL
+        self._cache = TTLCache(maxsize or Config.MEDIA_INDEX_SIZE, 0)
+        self._inflight: Dict[MediaKey, asyncio.Future] = {}
+    
+    def window(self, media_type: str) -> int:
+        """Dedup window in seconds for a media type (0 disables it)"""
+        return self.settings.get("media_dedup_windows", {}).get(media_type, 0)
+    
+    def key(self, message: Message) -> Optional[MediaKey]:
+        """Index key for a message's media, or None if it isn't deduplicated"""
+        if not message.media:
+            return None
+        media_type = message.media.value
+        if self.window(media_type) <= 0:
+            return None
+        file_unique_id = getattr(getattr(message, media_type, None), "file_unique_id", None)
+        return (media_type, file_unique_id) if file_unique_id else None
+    
+    def earlier(self, key: MediaKey) -> Optional[asyncio.Future]:
+        """Future for the owner-side message ID of an earlier delivery, if any.
+        
+        It resolves to None when that delivery fails or its ID is unknown.
+        """
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return pending
+        message_id = self._cache.get(key)
+        if message_id is None:
+            return None
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(message_id)
+        return future
+    
+    def remember(self, key: MediaKey, delivery: asyncio.Future):
+        """Index a delivery queued on the outbound scheduler"""
+        sent = self._inflight[key] = asyncio.get_event_loop().create_future()
+        
+        def done(future: asyncio.Future):
+            self._inflight.pop(key, None)
+            message_id = None
+            if not future.cancelled() and future.exception() is None:
+                result = future.result()
+                # forward_messages returns a list when given several IDs
+                if isinstance(result, list):
+                    result = result[0] if result else None
+                message_id = getattr(result, "id", None)
+            if message_id is not None:
+                self._cache.set(key, message_id, ttl=self.window(key[0]))
+            sent.set_result(message_id)
+        
+        delivery.add_done_callback(done)
+    
+    def __len__(self) -> int:
+        return len(self._cache)
+    
+    def load(self):
+        """Restore the index saved by a previous run"""
+        if not Path(self.path).exists():
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self._cache.load(json.load(f), key_type=tuple)
+            logger.info("Restored %s forwarded media entries", len(self._cache))
+        except Exception as e:
+            logger.error("Error loading media index: %s", e)
+    
+    async def save(self) -> bool:
+        """Save the index so a restart doesn't forward the same media again"""
+        # Snapshot on the event loop, write atomically on a worker thread
+        entries = self._cache.dump()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, write_json_atomic, self.path, entries)
+            return True
+        except Exception as e:
+            logger.error("Error saving media index: %s", e)
+            return False
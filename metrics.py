@@ -0,0 +1,346 @@
+"""
+Lightweight metrics for CrushBot (counters, gauges, latency histograms)
+
+All updates happen on the event loop thread, so the collectors are plain
+integer and float attributes with no locking. Labelled children are
+created once and then looked up by their label value, so recording a
+sample allocates nothing beyond the numbers themselves.
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """Monotonically increasing value"""
+    
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down"""
+    
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, amount: int = 1):
+        self.value += amount
+    
+    def dec(self, amount: int = 1):
+        self.value -= amount
+    
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed bucket layout"""
+    
+    __slots__ = ("buckets", "counts", "sum", "count")
+    
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # One slot per bucket plus the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Family:
+    """A named metric with children per label value"""
+    
+    def __init__(self, name: str, help_text: str, kind: str, label: Optional[str], factory):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label = label
+        self._factory = factory
+        self.children: Dict[str, object] = {}
+    
+    def labels(self, value: str = ""):
+        """Return the child for a label value, creating it on first use"""
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = self._factory()
+        return child
+
+
+class Registry:
+    """Collection of metric families rendered in Prometheus text format"""
+    
+    def __init__(self):
+        self.families: List[Family] = []
+    
+    def _family(self, name: str, help_text: str, kind: str, label: Optional[str], factory) -> Family:
+        family = Family(name, help_text, kind, label, factory)
+        self.families.append(family)
+        return family
+    
+    def counter(self, name: str, help_text: str, label: str = None) -> Family:
+        return self._family(name, help_text, "counter", label, Counter)
+    
+    def gauge(self, name: str, help_text: str, label: str = None) -> Family:
+        return self._family(name, help_text, "gauge", label, Gauge)
+    
+    def histogram(self, name: str, help_text: str, label: str = None,
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Family:
+        return self._family(name, help_text, "histogram", label, lambda: Histogram(buckets))
+    
+    def render(self) -> str:
+        """Prometheus text exposition of every metric"""
+        lines = []
+        for family in self.families:
+            lines.append(f"# HELP {family.name} {family.help_text}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for value, child in family.children.items():
+                labels = f'{family.label}="{value}"' if family.label else ""
+                if family.kind == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(child.buckets + (float("inf"),), child.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        bucket_labels = f'{labels},le="{le}"' if labels else f'le="{le}"'
+                        lines.append(f"{family.name}_bucket{{{bucket_labels}}} {cumulative}")
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{family.name}_sum{suffix} {child.sum}")
+                    lines.append(f"{family.name}_count{suffix} {child.count}")
+                else:
+                    suffix = f"{{{labels}}}" if labels else ""
+                    lines.append(f"{family.name}{suffix} {child.value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_CALLS = REGISTRY.counter("crushbot_handler_calls_total", "Handler invocations", "handler")
+HANDLER_ERRORS = REGISTRY.counter("crushbot_handler_errors_total", "Handler invocations that raised", "handler")
+HANDLER_LATENCY = REGISTRY.histogram("crushbot_handler_latency_seconds", "Handler run time", "handler")
+HANDLER_IN_FLIGHT = REGISTRY.gauge("crushbot_handler_in_flight", "Handler invocations currently running", "handler")
+
+OUTBOUND_CALLS = REGISTRY.counter("crushbot_outbound_calls_total", "Outbound API calls sent", "method")
+OUTBOUND_ERRORS = REGISTRY.counter("crushbot_outbound_errors_total", "Outbound API calls that failed", "method")
+OUTBOUND_FLOODWAITS = REGISTRY.counter("crushbot_outbound_floodwaits_total", "FloodWait errors received", "method")
+OUTBOUND_LATENCY = REGISTRY.histogram("crushbot_outbound_latency_seconds", "Outbound API call round-trip time", "method")
+OUTBOUND_QUEUED = REGISTRY.gauge("crushbot_outbound_queued", "Outbound calls waiting to be sent").labels()
+OUTBOUND_IN_FLIGHT = REGISTRY.gauge("crushbot_outbound_in_flight", "Outbound calls awaiting a response").labels()
+
+DISPATCH_QUEUED = REGISTRY.gauge("crushbot_dispatch_queued", "Updates waiting on a dispatch lane", "lane")
+DISPATCH_SHED = REGISTRY.counter("crushbot_dispatch_shed_total", "Updates shed because a lane was full", "lane")
+DISPATCH_LATENCY = REGISTRY.histogram(
+    "crushbot_dispatch_latency_seconds", "Time from enqueue to handler completion", "lane"
+)
+
+FLOOD_SUPPRESSED = REGISTRY.counter(
+    "crushbot_flood_suppressed_total", "Messages rejected by the flood guard", "kind"
+)
+
+MEDIA_DEDUPLICATED = REGISTRY.counter(
+    "crushbot_media_deduplicated_total", "Repeated media sent to the owner as a reference", "media"
+)
+
+STARTUP_SECONDS = REGISTRY.gauge(
+    "crushbot_startup_seconds", "Time from start() until ready to handle updates", "tenant"
+)
+
+START_TIME = time.time()
+
+
+def instrument(handler: str):
+    """Decorate an async handler to record calls, errors, latency and concurrency"""
+    calls = HANDLER_CALLS.labels(handler)
+    errors = HANDLER_ERRORS.labels(handler)
+    latency = HANDLER_LATENCY.labels(handler)
+    in_flight = HANDLER_IN_FLIGHT.labels(handler)
+    
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            calls.inc()
+            in_flight.inc()
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except BaseException:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+                in_flight.dec()
+        return wrapper
+    return decorator
+
+
+async def api_call(client, method: str, *args, **kwargs):
+    """Call a client API method directly, recorded like the outbound scheduler's calls"""
+    OUTBOUND_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        result = await getattr(client, method)(*args, **kwargs)
+    except Exception:
+        OUTBOUND_ERRORS.labels(method).inc()
+        raise
+    finally:
+        OUTBOUND_IN_FLIGHT.dec()
+        OUTBOUND_LATENCY.labels(method).observe(time.perf_counter() - started)
+    OUTBOUND_CALLS.labels(method).inc()
+    return result
+
+
+def format_stats() -> str:
+    """Human-readable metrics summary for the /stats command"""
+    uptime = int(time.time() - START_TIME)
+    lines = [
+        "📊 **CrushBot Stats**\n",
+        f"Uptime: {uptime // 3600}h {uptime % 3600 // 60}m {uptime % 60}s\n",
+        "**Handlers** (calls / errors / p50 / p99 / in flight):",
+    ]
+    for handler, hist in HANDLER_LATENCY.children.items():
+        lines.append(
+            f"• {handler}: {HANDLER_CALLS.labels(handler).value} / {HANDLER_ERRORS.labels(handler).value} / "
+            f"{_format_seconds(hist.quantile(0.5))} / {_format_seconds(hist.quantile(0.99))} / "
+            f"{HANDLER_IN_FLIGHT.labels(handler).value}"
+        )
+    
+    lines.append("\n**Lanes** (queued / shed / p50 / p99 from arrival):")
+    for lane, hist in DISPATCH_LATENCY.children.items():
+        lines.append(
+            f"• {lane}: {DISPATCH_QUEUED.labels(lane).value} / {DISPATCH_SHED.labels(lane).value} / "
+            f"{_format_seconds(hist.quantile(0.5))} / {_format_seconds(hist.quantile(0.99))}"
+        )
+    
+    lines.append("\n**Outbound** (calls / errors / FloodWaits / p50 / p99):")
+    for method, hist in OUTBOUND_LATENCY.children.items():
+        lines.append(
+            f"• {method}: {OUTBOUND_CALLS.labels(method).value} / {OUTBOUND_ERRORS.labels(method).value} / "
+            f"{OUTBOUND_FLOODWAITS.labels(method).value} / "
+            f"{_format_seconds(hist.quantile(0.5))} / {_format_seconds(hist.quantile(0.99))}"
+        )
+    lines.append(f"Queued: {OUTBOUND_QUEUED.value}, in flight: {OUTBOUND_IN_FLIGHT.value}")
+    return "\n".join(lines)
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    """Render a latency bound in milliseconds"""
+    if value is None:
+        return "-"
+    if value == float("inf"):
+        return f">{DEFAULT_BUCKETS[-1] * 1000:.0f}ms"
+    return f"≤{value * 1000:g}ms"
+
+
+class MetricsServer:
+    """Minimal local HTTP server exposing GET /metrics and GET /healthz"""
+    
+    def __init__(self, host: str = None, port: int = None, registry: Registry = REGISTRY,
+                 ready: Callable[[], bool] = None):
+        self.host = host or Config.METRICS_HOST
+        self.port = Config.METRICS_PORT if port is None else port
+        self.registry = registry
+        # /healthz reports 503 until this returns True
+        self.ready = ready
+        self._server: Optional[asyncio.AbstractServer] = None
+    
+    async def start(self):
+        """Start listening if a port is configured"""
+        if not self.port:
+            return
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Metrics endpoint listening on http://%s:%s/metrics", self.host, self.port)
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Drain the request headers
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            
+            parts = request_line.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else ""
+            path = path.split("?")[0]
+            if path == "/metrics":
+                status, body = "200 OK", self.registry.render()
+            elif path == "/healthz":
+                if self.ready is None or self.ready():
+                    status, body = "200 OK", "ready\n"
+                else:
+                    status, body = "503 Service Unavailable", "starting\n"
+            else:
+                status, body = "404 Not Found", "not found\n"
+            
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug("Metrics request failed: %s", e)
+        finally:
+            writer.close()
+    
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+def mark_ready(path: str = None):
+    """Create the readiness file (READY_FILE) holding this process's PID"""
+    path = Config.READY_FILE if path is None else path
+    if not path:
+        return
+    try:
+        Path(path).write_text(f"{os.getpid()}\n")
+    except OSError as e:
+        logger.error("Error writing readiness file %s: %s", path, e)
+
+
+def clear_ready(path: str = None):
+    """Remove the readiness file, e.g. one left behind by a crashed run"""
+    path = Config.READY_FILE if path is None else path
+    if not path:
+        return
+    try:
+        Path(path).unlink(missing_ok=True)
+    except OSError as e:
+        logger.error("Error removing readiness file %s: %s", path, e)
@@ -0,0 +1,294 @@
+"""
+Outbound message scheduling for CrushBot
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+from pyrogram import enums
+from pyrogram.errors import FloodWait, RPCError
+from pyrogram.types import Message
+
+import metrics
+from config import Config
+from outbox import DIGESTED
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket rate limiter for use on a single event loop"""
+    
+    __slots__ = ("rate", "capacity", "_tokens", "_updated")
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def full(self) -> bool:
+        """Whether the bucket has refilled, i.e. is as good as a new one"""
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity
+    
+    def reserve(self) -> float:
+        """Take one token and return how long to wait before using it"""
+        self._refill(time.monotonic())
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+    
+    async def acquire(self):
+        """Wait until a token is available"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class _Job:
+    """A single pending API call"""
+    
+    __slots__ = ("method", "kwargs", "future", "attempts", "key", "recorded")
+    
+    def __init__(self, method: str, kwargs: Dict[str, Any], future: asyncio.Future,
+                 key: str = None, recorded: asyncio.Future = None):
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+        # Outbox idempotency key, and the pending write that must land before sending
+        self.key = key
+        self.recorded = recorded
+
+
+class _ChatLane:
+    """Ordered queues of jobs for one destination chat"""
+    
+    __slots__ = ("bucket", "urgent", "jobs", "task")
+    
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        # Replies are served before bulk deliveries queued for the same chat
+        self.urgent = deque()
+        self.jobs = deque()
+        self.task: Optional[asyncio.Task] = None
+
+
+def _consume_exception(future: asyncio.Future):
+    """Mark a failed future's exception as retrieved (it is logged already)"""
+    if not future.cancelled():
+        future.exception()
+
+
+class OutboundScheduler:
+    """Send every outbound API call through global and per-chat rate limits.
+    
+    Calls to the same chat are delivered in submission order, except that
+    replies go ahead of queued bulk deliveries. A FloodWait
+    pauses only the chat that received it, after which the call is retried.
+    Callers get a future and only need to await it if they want the result.
+    
+    Calls submitted with an idempotency_key are durable: they are written
+    to the outbox before being sent, acknowledged afterwards, and retried
+    through FloodWaits for as long as it takes.
+    """
+    
+    def __init__(self, client, global_rate: float = None, private_rate: float = None,
+                 group_rate: float = None, max_retries: int = None, outbox=None, tenant: str = ""):
+        self.client = client
+        self.outbox = outbox
+        self.tenant = tenant
+        self.global_rate = global_rate or Config.OUTBOUND_GLOBAL_RATE
+        self.private_rate = private_rate or Config.OUTBOUND_PRIVATE_RATE
+        self.group_rate = group_rate or Config.OUTBOUND_GROUP_RATE
+        self.max_retries = Config.OUTBOUND_MAX_RETRIES if max_retries is None else max_retries
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._lanes: Dict[int, _ChatLane] = {}
+        # Kept apart from the lanes, which end whenever a chat's queue empties,
+        # so that paced traffic doesn't get a fresh burst every time
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self.max_buckets = Config.OUTBOUND_MAX_BUCKETS
+    
+    def _new_bucket(self, chat_id: int) -> TokenBucket:
+        """Create the rate limiter matching Telegram's limit for a chat"""
+        if chat_id > 0:
+            return TokenBucket(self.private_rate, Config.OUTBOUND_PRIVATE_BURST)
+        return TokenBucket(self.group_rate, Config.OUTBOUND_GROUP_BURST)
+    
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        """A chat's rate limiter, least recently used ones dropped once full again"""
+        bucket = self._buckets.get(chat_id)
+        if bucket is not None:
+            self._buckets.move_to_end(chat_id)
+            return bucket
+        # A full bucket behaves exactly like a new one, so dropping it loses nothing
+        while len(self._buckets) >= self.max_buckets:
+            oldest_id, oldest = next(iter(self._buckets.items()))
+            if not oldest.full():
+                break
+            del self._buckets[oldest_id]
+        bucket = self._buckets[chat_id] = self._new_bucket(chat_id)
+        return bucket
+    
+    def submit(self, method: str, idempotency_key: str = None, urgent: bool = False, **kwargs) -> asyncio.Future:
+        """Queue a client method call, laned by its chat_id argument"""
+        recorded = None
+        if idempotency_key is not None and self.outbox is not None:
+            if self.tenant:
+                # The outbox may be shared, so keys are scoped to the tenant
+                idempotency_key = f"{self.tenant}/{idempotency_key}"
+            recorded = self.outbox.record(idempotency_key, method, kwargs, self.tenant)
+        return self._enqueue(_Job(method, kwargs, None, idempotency_key, recorded), urgent)
+    
+    def hold(self, method: str, idempotency_key: str, **kwargs) -> Optional[str]:
+        """Write a call to the outbox without sending it, to be replayed after a crash.
+        
+        Returns the stored key for release(), or None without an outbox.
+        """
+        if self.outbox is None:
+            return None
+        if self.tenant:
+            idempotency_key = f"{self.tenant}/{idempotency_key}"
+        self.outbox.record(idempotency_key, method, kwargs, self.tenant)
+        return idempotency_key
+    
+    def release(self, key: Optional[str]):
+        """Drop a held call once whatever replaces it is queued"""
+        if key is not None and self.outbox is not None:
+            self.outbox.ack(key, DIGESTED)
+    
+    def _enqueue(self, job: _Job, urgent: bool = False) -> asyncio.Future:
+        """Append a job to its chat's lane, starting the lane if idle"""
+        chat_id = job.kwargs["chat_id"]
+        loop = asyncio.get_event_loop()
+        job.future = loop.create_future()
+        job.future.add_done_callback(_consume_exception)
+        
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _ChatLane(self._bucket(chat_id))
+        (lane.urgent if urgent else lane.jobs).append(job)
+        metrics.OUTBOUND_QUEUED.inc()
+        if lane.task is None:
+            lane.task = loop.create_task(self._run_lane(chat_id, lane))
+        return job.future
+    
+    async def replay(self) -> int:
+        """Re-queue deliveries the outbox holds from a previous run, in order"""
+        if self.outbox is None:
+            return 0
+        entries = await self.outbox.pending(self.tenant)
+        for key, method, kwargs in entries:
+            self._enqueue(_Job(method, kwargs, None, key))
+        if entries:
+            logger.info("Replaying %s undelivered outbox entries", len(entries))
+        return len(entries)
+    
+    def send_message(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Queue a text message"""
+        return self.submit("send_message", chat_id=chat_id, text=text, **kwargs)
+    
+    def forward(self, message: Message, chat_id: int, idempotency_key: str = None) -> asyncio.Future:
+        """Queue forwarding message to chat_id"""
+        return self.submit(
+            "forward_messages", idempotency_key=idempotency_key,
+            chat_id=chat_id, from_chat_id=message.chat.id, message_ids=message.id
+        )
+    
+    def reply(self, message: Message, text: str, **kwargs) -> asyncio.Future:
+        """Queue a reply in message's chat, quoting it outside private chats"""
+        if message.chat.type != enums.ChatType.PRIVATE:
+            kwargs.setdefault("reply_to_message_id", message.id)
+        return self.send_message(message.chat.id, text, urgent=True, **kwargs)
+    
+    async def _run_lane(self, chat_id: int, lane: _ChatLane):
+        """Deliver a chat's queued jobs in order until the queue is empty"""
+        try:
+            while lane.urgent or lane.jobs:
+                queue = lane.urgent or lane.jobs
+                job = queue[0]
+                if job.future.done():
+                    queue.popleft()
+                    metrics.OUTBOUND_QUEUED.dec()
+                    continue
+                
+                if job.recorded is not None:
+                    should_send = await job.recorded
+                    job.recorded = None
+                    if not should_send:
+                        logger.debug("Skipping %s already delivered", job.key)
+                        queue.popleft()
+                        metrics.OUTBOUND_QUEUED.dec()
+                        job.future.set_result(None)
+                        continue
+                
+                await lane.bucket.acquire()
+                await self._global.acquire()
+                
+                metrics.OUTBOUND_IN_FLIGHT.inc()
+                started = time.perf_counter()
+                try:
+                    result = await getattr(self.client, job.method)(**job.kwargs)
+                except FloodWait as e:
+                    metrics.OUTBOUND_FLOODWAITS.labels(job.method).inc()
+                    job.attempts += 1
+                    if job.attempts > self.max_retries and job.key is None:
+                        logger.error("Giving up on %s to %s after %s FloodWaits", job.method, chat_id, job.attempts)
+                        self._finish(queue, job, error=e)
+                        continue
+                    logger.warning("FloodWait on chat %s: pausing it for %s seconds", chat_id, e.value)
+                    await asyncio.sleep(e.value)
+                    continue
+                except RPCError as e:
+                    logger.error("Error in %s to %s: %s", job.method, chat_id, e)
+                    self._finish(queue, job, error=e, status="failed")
+                    continue
+                except Exception as e:
+                    # Not Telegram's verdict, so a durable call stays pending for replay
+                    logger.error("Error in %s to %s: %s", job.method, chat_id, e)
+                    self._finish(queue, job, error=e, status=None)
+                    continue
+                finally:
+                    metrics.OUTBOUND_IN_FLIGHT.dec()
+                    metrics.OUTBOUND_LATENCY.labels(job.method).observe(time.perf_counter() - started)
+                
+                metrics.OUTBOUND_CALLS.labels(job.method).inc()
+                self._finish(queue, job, result=result)
+        finally:
+            lane.task = None
+            if not lane.urgent and not lane.jobs and self._lanes.get(chat_id) is lane:
+                del self._lanes[chat_id]
+    
+    def _finish(self, queue: deque, job: _Job, result: Any = None, error: Exception = None,
+                status: Optional[str] = "sent"):
+        """Remove a completed job from its queue, acknowledge it and resolve its future"""
+        queue.popleft()
+        metrics.OUTBOUND_QUEUED.dec()
+        if job.key is not None and self.outbox is not None and status is not None:
+            self.outbox.ack(job.key, status)
+        if error is not None:
+            metrics.OUTBOUND_ERRORS.labels(job.method).inc()
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+    
+    def pending(self) -> int:
+        """Number of calls waiting to be sent"""
+        return sum(len(lane.urgent) + len(lane.jobs) for lane in self._lanes.values())
+    
+    async def drain(self, timeout: float = None):
+        """Wait until everything queued so far has been sent"""
+        tasks = [lane.task for lane in self._lanes.values() if lane.task]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
@@ -0,0 +1,250 @@
+"""
+Durable outbox for CrushBot owner deliveries (SQLite, WAL mode)
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pyrogram import enums
+from pyrogram.types import MessageEntity, User
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    method TEXT NOT NULL,
+    kwargs TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    updated INTEGER,
+    tenant TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, id);
+"""
+
+INSERT_SQL = "INSERT OR IGNORE INTO outbox (key, method, kwargs, created, tenant) VALUES (?, ?, ?, ?, ?)"
+ACK_SQL = "UPDATE outbox SET status = ?, updated = ? WHERE key = ?"
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+# Held while buffered for a digest, then delivered as part of it
+DIGESTED = "digested"
+
+
+def _encode(value: Any) -> Any:
+    """Turn API call arguments into JSON-safe values"""
+    if isinstance(value, MessageEntity):
+        return {"__entity__": {
+            "type": value.type.name,
+            "offset": value.offset,
+            "length": value.length,
+            "url": value.url,
+            "user_id": value.user.id if value.user else None,
+            "language": value.language,
+            "custom_emoji_id": value.custom_emoji_id,
+        }}
+    if isinstance(value, Enum):
+        return {"__enum__": type(value).__name__, "name": value.name}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value: Any) -> Any:
+    """Inverse of _encode"""
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        if "__entity__" in value:
+            fields = dict(value["__entity__"])
+            user_id = fields.pop("user_id")
+            return MessageEntity(
+                type=enums.MessageEntityType[fields.pop("type")],
+                user=User(id=user_id) if user_id else None,
+                **fields
+            )
+        if "__enum__" in value:
+            return getattr(enums, value["__enum__"])[value["name"]]
+    return value
+
+
+def encode_kwargs(kwargs: Dict[str, Any]) -> str:
+    """Serialize API call keyword arguments to JSON"""
+    return json.dumps({name: _encode(value) for name, value in kwargs.items()}, ensure_ascii=False)
+
+
+def decode_kwargs(text: str) -> Dict[str, Any]:
+    """Rebuild API call keyword arguments from JSON"""
+    return {name: _decode(value) for name, value in json.loads(text).items()}
+
+
+class Outbox:
+    """Write-ahead log of owner deliveries.
+    
+    Every delivery carries an idempotency key derived from its source
+    message. record() inserts it with INSERT OR IGNORE before the send is
+    attempted and resolves to False when the key was already delivered, so
+    a redelivered update or a replay is never forwarded twice. ack() marks
+    it sent (or failed for permanent errors); whatever is still pending at
+    startup is replayed in insertion order. A crash between a successful
+    send and its ack can still repeat that one call on the next start.
+    If a batch can't be written, it is kept and retried after
+    OUTBOX_RETRY_DELAY seconds; its sends go ahead meanwhile.
+    
+    Like the archive, the connection lives on one dedicated thread and
+    writes are batched, so a burst of deliveries costs one commit. Hosted
+    tenants share one outbox; keys must be unique across tenants, and each
+    tenant replays only its own entries.
+    """
+    
+    def __init__(self, path: str = None, retention: int = None):
+        self.path = path or Config.OUTBOX_FILE
+        self.retention = Config.OUTBOX_RETENTION if retention is None else retention
+        self._records: List[Tuple[Tuple, asyncio.Future]] = []
+        self._acks: List[Tuple[str, int, str]] = []
+        # Keys recorded or replayed by this process and not yet acked
+        self._active: Set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """Open the database, prune old entries and start the background writer"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._open)
+        self._wakeup = asyncio.Event()
+        if self._records or self._acks:
+            self._wakeup.set()
+        self._task = loop.create_task(self._writer())
+    
+    def _open(self):
+        """Create the connection and schema (runs on the outbox thread)"""
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        # Outboxes created before multi-tenant hosting lack the tenant column
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+        if "tenant" not in columns:
+            conn.execute("ALTER TABLE outbox ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+        # Delivered keys only need to outlive Telegram's update redelivery
+        conn.execute(
+            "DELETE FROM outbox WHERE status != ? AND updated < ?",
+            (PENDING, int(time.time()) - self.retention)
+        )
+        conn.commit()
+        self._conn = conn
+    
+    def record(self, key: str, method: str, kwargs: Dict[str, Any], tenant: str = "") -> asyncio.Future:
+        """Persist a delivery; the future resolves to whether it should be sent"""
+        future = asyncio.get_event_loop().create_future()
+        if key in self._active:
+            future.set_result(False)
+            return future
+        self._active.add(key)
+        # Serialized on the outbox thread, keeping JSON encoding off the event loop
+        self._records.append(((key, method, kwargs, int(time.time()), tenant), future))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return future
+    
+    def ack(self, key: str, status: str = SENT):
+        """Mark a delivery as finished"""
+        self._active.discard(key)
+        self._acks.append((status, int(time.time()), key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def pending(self, tenant: str = "") -> List[Tuple[str, str, Dict[str, Any]]]:
+        """A tenant's undelivered entries in insertion order, claimed for replay"""
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(self._executor, self._query_pending, tenant)
+        entries = []
+        for key, method, kwargs in rows:
+            if key in self._active:
+                continue
+            try:
+                entries.append((key, method, decode_kwargs(kwargs)))
+            except Exception as e:
+                logger.error("Dropping unreadable outbox entry %s: %s", key, e)
+                self.ack(key, FAILED)
+                continue
+            self._active.add(key)
+        return entries
+    
+    def _query_pending(self, tenant: str) -> List[Tuple]:
+        """Read undelivered rows (runs on the outbox thread)"""
+        return self._conn.execute(
+            "SELECT key, method, kwargs FROM outbox WHERE status = ? AND tenant = ? ORDER BY id", (PENDING, tenant)
+        ).fetchall()
+    
+    async def _writer(self):
+        """Commit records and acks as soon as there are any"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not await self.flush():
+                await asyncio.sleep(Config.OUTBOX_RETRY_DELAY)
+                self._wakeup.set()
+    
+    async def flush(self) -> bool:
+        """Write pending records and acks in one transaction; False if that failed"""
+        if (not self._records and not self._acks) or self._conn is None:
+            return True
+        records, self._records = self._records, []
+        acks, self._acks = self._acks, []
+        loop = asyncio.get_running_loop()
+        try:
+            delivered = await loop.run_in_executor(self._executor, self._write, [row for row, _ in records], acks)
+        except Exception as e:
+            # Send anyway: losing durability beats losing the message. The
+            # transaction was rolled back, so the whole batch is retried.
+            logger.error("Error writing %s outbox entries and %s acks: %s", len(records), len(acks), e)
+            self._records = records + self._records
+            self._acks = acks + self._acks
+            for _, future in records:
+                if not future.done():
+                    future.set_result(True)
+            return False
+        for (key, *_), future in records:
+            if key in delivered:
+                self._active.discard(key)
+            if not future.done():
+                future.set_result(key not in delivered)
+        return True
+    
+    def _write(self, rows: List[Tuple], acks: List[Tuple]) -> Set[str]:
+        """Insert records and apply acks, returning keys already delivered (runs on the outbox thread)"""
+        delivered = set()
+        with self._conn:
+            for key, method, kwargs, created, tenant in rows:
+                row = (key, method, encode_kwargs(kwargs), created, tenant)
+                if self._conn.execute(INSERT_SQL, row).rowcount == 0:
+                    status = self._conn.execute("SELECT status FROM outbox WHERE key = ?", (key,)).fetchone()
+                    if status and status[0] != PENDING:
+                        delivered.add(key)
+            self._conn.executemany(ACK_SQL, acks)
+        return delivered
+    
+    async def close(self):
+        """Stop the writer, flush what is left and close the database"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._conn is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
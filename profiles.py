@@ -0,0 +1,154 @@
+"""
+Sender and chat profile cache for CrushBot
+"""
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from pyrogram import enums
+from pyrogram.types import Chat, Message, User
+
+import metrics
+from cache import TTLCache
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts at most this many IDs per users.getUsers call
+GET_USERS_LIMIT = 200
+
+
+class ProfileCache:
+    """Display names for users and chats, learned from passing updates.
+    
+    Every observed message refreshes the labels of its sender, chat,
+    sender_chat, replied-to author and mentioned users, and remembers who
+    wrote it so a reply whose reply_to_message is missing can still be
+    attributed. When a label is needed for a user the cache has never seen
+    complete, lookups from all handlers are collected for a short moment
+    and resolved with one get_users call.
+    """
+    
+    def __init__(self, client, maxsize: int = None, ttl: float = None):
+        self.client = client
+        maxsize = maxsize or Config.PROFILE_CACHE_SIZE
+        ttl = ttl or Config.PROFILE_TTL
+        self._users = TTLCache(maxsize, ttl)
+        self._chats = TTLCache(maxsize, ttl)
+        # (chat_id, message_id) -> sender ID, for attributing replies
+        self._authors = TTLCache(maxsize, ttl)
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._batch: Optional[asyncio.TimerHandle] = None
+    
+    @staticmethod
+    def _user_label(user: User) -> Optional[str]:
+        if user.username:
+            return f"@{user.username}"
+        name = " ".join(filter(None, (user.first_name, user.last_name)))
+        return name or None
+    
+    @staticmethod
+    def _chat_label(chat: Chat) -> Optional[str]:
+        if chat.username and not chat.title:
+            return f"@{chat.username}"
+        return chat.title or " ".join(filter(None, (chat.first_name, chat.last_name))) or None
+    
+    def _remember_user(self, user: Optional[User]):
+        if user is not None:
+            label = self._user_label(user)
+            if label:
+                self._users.set(user.id, label)
+    
+    def _remember_chat(self, chat: Optional[Chat]):
+        if chat is not None:
+            label = self._chat_label(chat)
+            if label:
+                self._chats.set(chat.id, label)
+    
+    def observe(self, message: Message):
+        """Learn whatever profiles a message carries"""
+        self._remember_user(message.from_user)
+        if message.chat.type == enums.ChatType.PRIVATE:
+            # A private chat is named after its user, and reply attribution
+            # only matters in groups
+            return
+        self._remember_chat(message.sender_chat)
+        self._remember_chat(message.chat)
+        author = message.from_user or message.sender_chat
+        if author is not None:
+            self._authors.set((message.chat.id, message.id), author.id)
+        
+        reply = message.reply_to_message
+        if reply is not None:
+            self._remember_user(reply.from_user)
+            self._remember_chat(reply.sender_chat)
+            reply_author = reply.from_user or reply.sender_chat
+            if reply_author is not None:
+                self._authors.set((message.chat.id, reply.id), reply_author.id)
+        
+        for entity in message.entities or ():
+            self._remember_user(entity.user)
+    
+    def sender(self, message: Message) -> Tuple[Optional[int], str]:
+        """Sender ID and label; anonymous admins and channels are named by sender_chat"""
+        if message.from_user is not None:
+            return message.from_user.id, self.user_label(message.from_user)
+        if message.sender_chat is not None:
+            return message.sender_chat.id, self.chat_label(message.sender_chat)
+        return None, "Unknown sender"
+    
+    def user_label(self, user: User) -> str:
+        """Best label available without a lookup"""
+        return self._user_label(user) or self._users.get(user.id) or str(user.id)
+    
+    def chat_label(self, chat: Chat) -> str:
+        """Best chat label available without a lookup"""
+        return self._chat_label(chat) or self._chats.get(chat.id) or str(chat.id)
+    
+    def author_of(self, chat_id: int, message_id: int) -> Optional[int]:
+        """Sender of a message seen earlier, if remembered"""
+        return self._authors.get((chat_id, message_id))
+    
+    async def resolve_sender(self, message: Message) -> Tuple[Optional[int], str]:
+        """Like sender(), but fetches a user's profile when nothing names them"""
+        user = message.from_user
+        if user is None or self._user_label(user) or user.id in self._users:
+            return self.sender(message)
+        return user.id, await self.lookup(user.id)
+    
+    def lookup(self, user_id: int) -> asyncio.Future:
+        """Resolve a user's label, batching concurrent misses into one get_users call"""
+        loop = asyncio.get_event_loop()
+        future = self._waiting.get(user_id)
+        if future is None:
+            future = self._waiting[user_id] = loop.create_future()
+            if self._batch is None:
+                self._batch = loop.call_later(
+                    Config.PROFILE_BATCH_DELAY, lambda: loop.create_task(self._fetch())
+                )
+        return future
+    
+    async def _fetch(self):
+        """Fetch every waiting user in as few get_users calls as possible"""
+        self._batch = None
+        waiting, self._waiting = self._waiting, {}
+        ids = list(waiting)
+        failed = set()
+        for start in range(0, len(ids), GET_USERS_LIMIT):
+            chunk = ids[start:start + GET_USERS_LIMIT]
+            try:
+                users = await metrics.api_call(self.client, "get_users", chunk)
+                for user in users if isinstance(users, list) else [users]:
+                    self._remember_user(user)
+            except Exception as e:
+                logger.error("Error looking up %s users: %s", len(chunk), e)
+                failed.update(chunk)
+        for user_id, future in waiting.items():
+            label = self._users.get(user_id)
+            if label is None:
+                label = str(user_id)
+                if user_id not in failed:
+                    # Nameless (e.g. deleted) accounts: don't look them up again until the TTL expires
+                    self._users.set(user_id, label)
+            if not future.done():
+                future.set_result(label)
@@ -0,0 +1,283 @@
+"""
+Group message classification on worker processes for CrushBot
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from watchlist import Watchlist
+
+logger = logging.getLogger(__name__)
+
+# (seq, chat_id, text, caption, [(entity type, offset, length, user_id)])
+Snapshot = Tuple[int, int, str, str, List[Tuple[str, int, int, Optional[int]]]]
+# (seq, mentioned_bot, mentioned_owner, watchlist hits)
+Verdict = Tuple[int, bool, bool, List[str]]
+
+# Only these entities matter to classification
+MENTION_TYPES = ("MENTION", "TEXT_MENTION")
+
+
+def snapshot(seq: int, message) -> Snapshot:
+    """Reduce a group message to the plain data a shard needs"""
+    mentions = [
+        (entity.type.name, entity.offset, entity.length, entity.user.id if entity.user else None)
+        for entity in message.entities or () if entity.type.name in MENTION_TYPES
+    ]
+    return seq, message.chat.id, str(message.text or ""), str(message.caption or ""), mentions
+
+
+def _utf16_slice(text: str, start: int, end: int) -> str:
+    """Slice text by UTF-16 code units, as Telegram entity offsets count them"""
+    return text.encode("utf-16-le")[start * 2:end * 2].decode("utf-16-le", errors="ignore")
+
+
+def classify(item: Snapshot, bot_username: Optional[str], owner_id: int, watchlist: Watchlist) -> Verdict:
+    """What CrushBot._check_mentions and Watchlist.match would say about a message"""
+    seq, _, text, caption, mentions = item
+    mentioned_bot = mentioned_owner = False
+    for kind, offset, length, user_id in mentions:
+        if kind == "MENTION":
+            if bot_username and _utf16_slice(text, offset + 1, offset + length).lower() == bot_username.lower():
+                mentioned_bot = True
+        elif user_id == owner_id:
+            mentioned_owner = True
+    return seq, mentioned_bot, mentioned_owner, watchlist.match(text or caption)
+
+
+def _shard_main(inbox, results):
+    """Worker process loop: apply configuration, classify batches in order"""
+    bot_username, owner_id, watchlist = None, 0, Watchlist({})
+    while True:
+        item = inbox.get()
+        if item is None:
+            return
+        kind, payload = item
+        if kind == "configure":
+            bot_username, owner_id, entries = payload
+            watchlist = Watchlist({"watchlist": entries})
+        else:
+            results.put([classify(snap, bot_username, owner_id, watchlist) for snap in payload])
+
+
+class ShardPool:
+    """Classify group messages on a pool of worker processes.
+    
+    Mention parsing and watchlist matching are the CPU-bound part of group
+    traffic. submit() sends a plain snapshot of each message to the
+    worker chosen by chat ID, so every chat is classified in order by the
+    same process; snapshots submitted in one loop iteration travel as one
+    batch per worker. Verdicts come back on a shared queue and are handed,
+    in order, to on_results with the original messages, which stay in this
+    process, as do all state and outbound calls.
+    
+    A watchdog checks the workers every SHARD_CHECK_INTERVAL seconds. A
+    worker that died, or has held a message for more than SHARD_TIMEOUT
+    seconds (e.g. stuck on a slow regex), is replaced, and the messages it
+    held are classified in-process instead.
+    """
+    
+    def __init__(self, workers: int, on_results: Callable[[List[Tuple[Any, Any, Verdict]]], Awaitable],
+                 max_pending: int = None):
+        self.workers = workers
+        self.on_results = on_results
+        self.max_pending = max_pending or Config.SHARD_MAX_PENDING
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = []
+        self._inboxes = []
+        self._results = None
+        self._reader: Optional[threading.Thread] = None
+        # seq -> (message, context, worker index or None once taken back, submit time)
+        self._pending: Dict[int, Tuple[Any, Any, Optional[int], float]] = {}
+        self._buffers: List[List[Snapshot]] = []
+        self._flush_scheduled = False
+        self._seq = 0
+        self._ready: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._full = False
+        self._watchdog: Optional[asyncio.Task] = None
+        # Last configure() arguments, replayed to replacement workers
+        self._config: Tuple[Optional[str], int, Dict[str, List[str]]] = (None, 0, {})
+        self._local: Optional[Watchlist] = None
+    
+    def _spawn(self, index: int):
+        """Start (or replace) worker number index and send it the current configuration"""
+        inbox = self._context.Queue()
+        process = self._context.Process(
+            target=_shard_main, args=(inbox, self._results), name=f"crushbot-shard-{index}", daemon=True
+        )
+        process.start()
+        inbox.put(("configure", self._config))
+        if index < len(self._processes):
+            self._inboxes[index], self._processes[index] = inbox, process
+        else:
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+    
+    def start(self):
+        """Launch the worker processes, the result reader and the watchdog"""
+        loop = asyncio.get_event_loop()
+        self._results = self._context.Queue()
+        for index in range(self.workers):
+            self._spawn(index)
+        self._buffers = [[] for _ in range(self.workers)]
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._consumer = loop.create_task(self._consume())
+        self._watchdog = loop.create_task(self._watch())
+        self._reader = threading.Thread(target=self._read, args=(loop,), name="shard-results", daemon=True)
+        self._reader.start()
+        logger.info("Started %s shard workers", self.workers)
+    
+    def configure(self, bot_username: Optional[str], owner_id: int, watchlist: Dict[str, List[str]]):
+        """Send the classification inputs to every worker; takes effect in order with submissions"""
+        self._flush()
+        self._config = (bot_username, owner_id, watchlist)
+        self._local = None
+        for inbox in self._inboxes:
+            inbox.put(("configure", self._config))
+    
+    def submit(self, message, context: Any = None) -> bool:
+        """Queue a message for classification; False when the workers are too far behind"""
+        if len(self._pending) >= self.max_pending:
+            if not self._full:
+                logger.warning("Shard workers are %s messages behind, classifying in-process", len(self._pending))
+                self._full = True
+            return False
+        self._full = False
+        self._seq += 1
+        worker = message.chat.id % self.workers
+        self._pending[self._seq] = (message, context, worker, time.monotonic())
+        self._idle.clear()
+        self._buffers[worker].append(snapshot(self._seq, message))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_event_loop().call_soon(self._flush)
+        return True
+    
+    def _flush(self):
+        """Send each worker its buffered snapshots as one batch"""
+        self._flush_scheduled = False
+        for index, buffer in enumerate(self._buffers):
+            if buffer:
+                self._inboxes[index].put(("batch", buffer))
+                self._buffers[index] = []
+    
+    def _read(self, loop: asyncio.AbstractEventLoop):
+        """Reader thread: pass verdict batches to the event loop"""
+        while True:
+            batch = self._results.get()
+            if batch is None:
+                return
+            loop.call_soon_threadsafe(self._ready.put_nowait, batch)
+    
+    async def _consume(self):
+        """Hand verdicts to on_results one batch at a time, preserving order"""
+        while True:
+            batches = [await self._ready.get()]
+            while not self._ready.empty():
+                batches.append(self._ready.get_nowait())
+            results = []
+            for batch in batches:
+                for verdict in batch:
+                    # A replaced worker's late verdicts were already handled in-process
+                    entry = self._pending.pop(verdict[0], None)
+                    if entry is not None:
+                        results.append((entry[0], entry[1], verdict))
+            try:
+                await self.on_results(results)
+            except Exception as e:
+                logger.error("Error handling shard results: %s", e)
+            if not self._pending:
+                self._idle.set()
+    
+    async def _watch(self):
+        """Replace dead or stuck workers and classify what they held in-process"""
+        while True:
+            await asyncio.sleep(Config.SHARD_CHECK_INTERVAL)
+            try:
+                self._check()
+            except Exception as e:
+                logger.error("Error checking shard workers: %s", e)
+    
+    def _check(self):
+        """One watchdog pass"""
+        now = time.monotonic()
+        stuck = set()
+        for _, _, worker, submitted in self._pending.values():
+            if worker is not None and now - submitted > Config.SHARD_TIMEOUT:
+                stuck.add(worker)
+        for index, process in enumerate(self._processes):
+            if process.is_alive() and index not in stuck:
+                continue
+            alive = process.is_alive()
+            if alive:
+                logger.error("Shard worker %s is stuck, replacing it", index)
+                process.terminate()
+            else:
+                logger.error("Shard worker %s died (exit code %s), replacing it", index, process.exitcode)
+            self._spawn(index)
+            # A stuck worker most likely hangs in a watchlist regex, which
+            # would hang the event loop just the same
+            self._classify_locally(index, watch=not alive)
+    
+    def _classify_locally(self, worker: int, watch: bool = True):
+        """Classify a replaced worker's pending messages in this process, in order.
+        
+        With watch=False only mentions are checked, not the watchlist.
+        """
+        seqs = sorted(seq for seq, entry in self._pending.items() if entry[2] == worker)
+        # Snapshots buffered for it but not yet sent are among these as well
+        self._buffers[worker] = []
+        if not seqs:
+            return
+        if self._local is None:
+            self._local = Watchlist({"watchlist": self._config[2]})
+        watchlist = self._local if watch else Watchlist({})
+        bot_username, owner_id, _ = self._config
+        verdicts = []
+        for seq in seqs:
+            message, context, _, submitted = self._pending[seq]
+            # No longer held by any worker, so the watchdog leaves it alone
+            self._pending[seq] = (message, context, None, submitted)
+            verdicts.append(classify(snapshot(seq, message), bot_username, owner_id, watchlist))
+        logger.warning("Classified %s messages of shard worker %s in-process", len(verdicts), worker)
+        self._ready.put_nowait(verdicts)
+    
+    def pending(self) -> int:
+        """Messages submitted and not yet handed to on_results"""
+        return len(self._pending)
+    
+    async def drain(self, timeout: float = None):
+        """Wait until every submitted message has been handled"""
+        if self._idle is None:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Gave up waiting for %s messages on shard workers", len(self._pending))
+    
+    async def stop(self, timeout: float = None):
+        """Finish submitted messages, then stop the workers and the reader"""
+        await self.drain(timeout)
+        for inbox in self._inboxes:
+            inbox.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        if self._results is not None:
+            self._results.put(None)
+            await loop.run_in_executor(None, self._reader.join, 5)
+        if self._consumer is not None:
+            self._consumer.cancel()
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        self._processes, self._inboxes = [], []
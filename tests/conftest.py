@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_client import FakeClient  # noqa: E402
+from bot import CrushBot  # noqa: E402
+from config import Config  # noqa: E402
+
+OWNER_ID = 1
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """A CrushBot on a FakeClient, keeping its files in a temporary directory"""
+    monkeypatch.chdir(tmp_path)
+    for name, value in (("API_ID", 1), ("API_HASH", "hash"), ("BOT_TOKEN", "token"), ("OWNER_ID", OWNER_ID)):
+        monkeypatch.setattr(Config, name, value)
+    return CrushBot(client=FakeClient())
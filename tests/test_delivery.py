@@ -0,0 +1,36 @@
+import asyncio
+
+from pyrogram.errors import BadRequest
+
+from benchmarks.fake_client import MessageFactory
+from conftest import OWNER_ID
+
+
+def test_rejected_copy_falls_back_to_header_and_forward(bot):
+    sent = []
+    
+    async def send_message(chat_id, text, **kwargs):
+        if kwargs.get("entities") is not None:
+            raise BadRequest("ENTITY_NOT_ALLOWED")
+        sent.append(("send_message", text.splitlines()[0]))
+    
+    async def forward_messages(chat_id, from_chat_id, message_ids, **kwargs):
+        sent.append(("forward_messages", message_ids))
+    
+    bot.app.send_message = send_message
+    bot.app.forward_messages = forward_messages
+    
+    async def run():
+        await bot.start()
+        bot.settings.set("forward_mode", "copy")
+        message = MessageFactory(OWNER_ID).private(42, "hello")
+        await bot.app.dispatch(message)
+        await bot.dispatcher.drain()
+        await asyncio.sleep(0.05)
+        await bot.outbound.drain()
+        await bot.stop()
+        return message.id
+    
+    message_id = asyncio.run(run())
+    assert ("send_message", "📨 **New Message**") in sent
+    assert ("forward_messages", message_id) in sent
@@ -0,0 +1,34 @@
+import asyncio
+
+from benchmarks.fake_client import MessageFactory
+from conftest import OWNER_ID
+
+
+def test_updates_during_stop_do_not_hang(bot):
+    factory = MessageFactory(OWNER_ID)
+    
+    async def run():
+        await bot.start()
+        stopping = asyncio.ensure_future(bot.stop())
+        await asyncio.sleep(0)
+        dm = asyncio.ensure_future(bot.app.dispatch(factory.private(42, "hello")))
+        group = asyncio.ensure_future(bot.app.dispatch(factory.group_message(-100, 43, "hi", mention_bot=True)))
+        await stopping
+        return await asyncio.wait_for(asyncio.gather(dm, group), 1)
+    
+    assert asyncio.run(run()) == [False, False]
+
+
+def test_updates_before_start_wait_for_readiness(bot):
+    factory = MessageFactory(OWNER_ID)
+    
+    async def run():
+        dm = asyncio.ensure_future(bot.app.dispatch(factory.private(42, "hello")))
+        await asyncio.sleep(0.01)
+        assert not dm.done()
+        await bot.start()
+        handled = await asyncio.wait_for(dm, 1)
+        await bot.stop()
+        return handled
+    
+    assert asyncio.run(run())
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+from benchmarks.fake_client import FakeClient
+from config import Config
+from outbound import OutboundScheduler
+
+
+def test_private_rate_holds_across_idle_gaps(monkeypatch):
+    monkeypatch.setattr(Config, "OUTBOUND_PRIVATE_BURST", 2)
+    
+    async def run():
+        scheduler = OutboundScheduler(FakeClient(), private_rate=20)
+        started = time.monotonic()
+        # Each send is awaited, so the chat's queue empties in between
+        for i in range(10):
+            await scheduler.send_message(42, f"message {i}")
+        return time.monotonic() - started
+    
+    # 2 sends from the burst, then one every 1/20s
+    assert asyncio.run(run()) >= (10 - 2) / 20 * 0.9
+
+
+def test_refilled_buckets_are_evicted():
+    async def run():
+        scheduler = OutboundScheduler(FakeClient(), private_rate=1000)
+        scheduler.max_buckets = 2
+        for chat_id in (1, 2):
+            await scheduler.send_message(chat_id, "hi")
+        await asyncio.sleep(0.01)
+        await scheduler.send_message(3, "hi")
+        return list(scheduler._buckets)
+    
+    assert asyncio.run(run()) == [2, 3]
@@ -0,0 +1,112 @@
+import asyncio
+
+from benchmarks.fake_client import FakeClient, MessageFactory
+from config import Settings
+from digest import DigestBuffer
+from outbound import OutboundScheduler
+from outbox import Outbox
+
+OWNER_ID = 1
+
+
+async def reopen(path) -> list:
+    """Pending entries as the next start would replay them"""
+    outbox = Outbox(path)
+    await outbox.start()
+    entries = await outbox.pending()
+    await outbox.close()
+    return entries
+
+
+def test_failed_write_keeps_acks(tmp_path, monkeypatch):
+    path = str(tmp_path / "outbox.db")
+    
+    async def run():
+        outbox = Outbox(path)
+        await outbox.start()
+        assert await outbox.record("a", "send_message", {"chat_id": OWNER_ID, "text": "hi"})
+        outbox.ack("a")
+        
+        write = outbox._write
+        
+        def fail(rows, acks):
+            raise OSError("disk full")
+        
+        monkeypatch.setattr(outbox, "_write", fail)
+        assert not await outbox.flush()
+        monkeypatch.setattr(outbox, "_write", write)
+        assert await outbox.flush()
+        await outbox.close()
+        return await reopen(path)
+    
+    assert asyncio.run(run()) == []
+
+
+def test_buffered_digest_events_survive_a_crash(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    
+    async def run():
+        outbox = Outbox(path)
+        await outbox.start()
+        client = FakeClient()
+        outbound = OutboundScheduler(client, outbox=outbox)
+        digest = DigestBuffer(outbound, OWNER_ID, Settings(str(tmp_path / "settings.json")))
+        message = MessageFactory(OWNER_ID).private(42, "hello")
+        digest.add("dm", message, "User42", 42)
+        await outbox.flush()
+        
+        # A crash now would replay the buffered message as a plain forward
+        crashed = await reopen(path)
+        
+        digest.flush()
+        await outbound.drain()
+        await outbox.close()
+        return crashed, await reopen(path), client.calls
+    
+    crashed, after_flush, calls = asyncio.run(run())
+    assert [(method, kwargs["message_ids"]) for _, method, kwargs in crashed] == [("forward_messages", 1)]
+    assert after_flush == []
+    assert calls["forward_messages"] == 1
+
+
+def test_consecutive_digests_starting_with_the_same_message(tmp_path):
+    async def run():
+        outbox = Outbox(str(tmp_path / "outbox.db"))
+        await outbox.start()
+        client = FakeClient()
+        outbound = OutboundScheduler(client, outbox=outbox)
+        settings = Settings(str(tmp_path / "settings.json"))
+        settings.set("digest_max_events", 1)
+        digest = DigestBuffer(outbound, OWNER_ID, settings)
+        message = MessageFactory(OWNER_ID).group_message(-100, 42, "hi @crushbot", mention_bot=True, mention_owner=True)
+        digest.add("bot_mention", message, "User42", 42)
+        digest.add("owner_mention", message, "User42", 42)
+        await outbound.drain()
+        await outbox.close()
+        return client.calls
+    
+    calls = asyncio.run(run())
+    assert calls["send_message"] == 2
+    assert calls["forward_messages"] == 2
+
+
+def test_digest_forwards_each_message_once(tmp_path):
+    async def run():
+        client = FakeClient()
+        outbound = OutboundScheduler(client)
+        digest = DigestBuffer(outbound, OWNER_ID, Settings(str(tmp_path / "settings.json")))
+        message = MessageFactory(OWNER_ID).group_message(-100, 42, "hi", mention_bot=True, mention_owner=True)
+        sent = []
+        
+        async def forward_messages(chat_id, from_chat_id, message_ids, **kwargs):
+            sent.append(message_ids)
+        
+        client.forward_messages = forward_messages
+        digest.add("bot_mention", message, "User42", 42)
+        digest.add("owner_mention", message, "User42", 42)
+        digest.flush()
+        await outbound.drain()
+        return sent, message.id
+    
+    sent, message_id = asyncio.run(run())
+    assert sent == [[message_id]]
@@ -0,0 +1,23 @@
+import asyncio
+
+import metrics
+from benchmarks.fake_client import FakeClient
+from profiles import ProfileCache
+
+
+def test_batched_lookups_are_one_instrumented_call():
+    calls = metrics.OUTBOUND_CALLS.labels("get_users")
+    latency = metrics.OUTBOUND_LATENCY.labels("get_users")
+    before, observed = calls.value, latency.count
+    
+    async def run():
+        client = FakeClient()
+        profiles = ProfileCache(client)
+        labels = await asyncio.gather(*(profiles.lookup(user_id) for user_id in (5, 6, 7)))
+        return labels, client.calls["get_users"]
+    
+    labels, requests = asyncio.run(run())
+    assert labels == ["user5", "user6", "user7"]
+    assert requests == 1
+    assert calls.value == before + 1
+    assert latency.count == observed + 1
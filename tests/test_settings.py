@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+import config
+from config import Config, Settings
+
+
+def test_failed_background_write_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SETTINGS_FLUSH_DELAY", 0.01)
+    monkeypatch.setattr(Config, "SETTINGS_RETRY_DELAY", 0.05)
+    path = tmp_path / "settings.json"
+    write = config.write_json_atomic
+    failures = []
+    
+    def flaky(*args, **kwargs):
+        if not failures:
+            failures.append(1)
+            raise OSError("disk full")
+        write(*args, **kwargs)
+    
+    monkeypatch.setattr(config, "write_json_atomic", flaky)
+    
+    async def run():
+        settings = Settings(str(path))
+        settings.set("offline_message", "brb")
+        await asyncio.sleep(0.3)
+    
+    asyncio.run(run())
+    assert failures
+    assert json.loads(path.read_text())["offline_message"] == "brb"
+
+
+def test_flush_reports_a_failed_write(tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    
+    monkeypatch.setattr(config, "write_json_atomic", fail)
+    
+    async def run():
+        settings = Settings(str(tmp_path / "settings.json"))
+        settings.set("offline_message", "brb")
+        return await settings.flush()
+    
+    assert asyncio.run(run()) is False
@@ -0,0 +1,63 @@
+import asyncio
+
+from benchmarks.fake_client import MessageFactory
+from config import Config
+from shards import ShardPool
+
+OWNER_ID = 1
+
+
+def test_messages_of_a_dead_worker_are_classified_in_process(monkeypatch):
+    monkeypatch.setattr(Config, "SHARD_CHECK_INTERVAL", 0.05)
+    factory = MessageFactory(OWNER_ID)
+    
+    async def run():
+        handled = []
+        
+        async def on_results(results):
+            handled.extend((message.text, verdict[3]) for message, _, verdict in results)
+        
+        pool = ShardPool(1, on_results)
+        pool.start()
+        pool.configure("crushbot", OWNER_ID, {"keywords": ["needle"], "patterns": []})
+        # Kill the worker before it sees anything
+        pool._processes[0].kill()
+        pool._processes[0].join()
+        pool.submit(factory.group_message(-100, 42, "a needle"))
+        pool.submit(factory.group_message(-100, 42, "hay"))
+        await pool.drain(timeout=5)
+        dead = pool.pending()
+        # The replacement worker takes new messages
+        pool.submit(factory.group_message(-100, 42, "another needle"))
+        await pool.drain(timeout=30)
+        await pool.stop(timeout=1)
+        return dead, handled
+    
+    dead, handled = asyncio.run(run())
+    assert dead == 0
+    assert handled == [("a needle", ["needle"]), ("hay", []), ("another needle", ["needle"])]
+
+
+def test_a_stuck_worker_is_replaced(monkeypatch):
+    monkeypatch.setattr(Config, "SHARD_CHECK_INTERVAL", 0.05)
+    monkeypatch.setattr(Config, "SHARD_TIMEOUT", 0.5)
+    factory = MessageFactory(OWNER_ID)
+    
+    async def run():
+        handled = []
+        
+        async def on_results(results):
+            handled.extend((message.text, verdict[1]) for message, _, verdict in results)
+        
+        pool = ShardPool(1, on_results)
+        pool.start()
+        # Catastrophic backtracking keeps the worker busy far past the timeout
+        pool.configure("crushbot", OWNER_ID, {"keywords": [], "patterns": ["(a+)+$"]})
+        pool.submit(factory.group_message(-100, 42, "a" * 40 + "!", mention_bot=True))
+        await pool.drain(timeout=10)
+        await pool.stop(timeout=1)
+        return pool.pending(), handled
+    
+    pending, handled = asyncio.run(run())
+    assert pending == 0
+    assert handled == [("a" * 40 + "! @crushbot", True)]
@@ -0,0 +1,44 @@
+import re
+
+import pytest
+
+from config import Settings
+from watchlist import Watchlist
+
+
+@pytest.fixture
+def settings(tmp_path):
+    return Settings(str(tmp_path / "settings.json"))
+
+
+def test_inline_flags_pattern_survives_restart(settings):
+    watchlist = Watchlist(settings)
+    assert watchlist.add("/(?i)crush/")
+    assert watchlist.add("/hello/")
+    assert watchlist.match("My CRUSH said hello") == ["/(?i)crush/", "/hello/"]
+    
+    restarted = Watchlist(Settings(settings.config_file))
+    assert restarted.entries() == ["/(?i)crush/", "/hello/"]
+    assert restarted.match("crush") == ["/(?i)crush/"]
+
+
+def test_backreference_matches(settings):
+    watchlist = Watchlist(settings)
+    watchlist.add("/x/")
+    watchlist.add(r"/(ab)\1/")
+    assert watchlist.match("abab") == [r"/(ab)\1/"]
+    assert watchlist.match("abxb") == ["/x/"]
+
+
+def test_invalid_pattern_is_rejected_without_saving(settings):
+    watchlist = Watchlist(settings)
+    with pytest.raises(re.error):
+        watchlist.add("/(unclosed/")
+    assert watchlist.entries() == []
+
+
+def test_invalid_stored_pattern_is_skipped(settings):
+    settings.set("watchlist", {"keywords": ["crush"], "patterns": ["(unclosed", "ok+"]})
+    watchlist = Watchlist(settings)
+    assert watchlist.entries() == ["crush", "/ok+/"]
+    assert watchlist.match("my crush is okk") == ["crush", "/ok+/"]
@@ -0,0 +1,196 @@
+"""
+Keyword and pattern watchlist for CrushBot group messages
+"""
+import logging
+import re
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """Case-insensitive multi-keyword matcher.
+    
+    Keywords are inserted into the trie incrementally and removed by
+    dropping their outputs, so the automaton is never rebuilt from scratch
+    for a single change; only the failure links are recomputed, lazily,
+    before the next search. Matches must start and end on word boundaries.
+    """
+    
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[str]] = [set()]
+        # Outputs including those inherited through failure links
+        self._all_out: List[Set[str]] = [set()]
+        self._keywords: Set[str] = set()
+        self._dirty = False
+    
+    def __len__(self) -> int:
+        return len(self._keywords)
+    
+    def add(self, keyword: str):
+        """Insert a keyword"""
+        keyword = keyword.casefold()
+        if not keyword or keyword in self._keywords:
+            return
+        node = 0
+        for char in keyword:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+                self._all_out.append(set())
+            node = nxt
+        self._out[node].add(keyword)
+        self._keywords.add(keyword)
+        self._dirty = True
+    
+    def remove(self, keyword: str) -> bool:
+        """Stop matching a keyword; its trie nodes are left in place"""
+        keyword = keyword.casefold()
+        if keyword not in self._keywords:
+            return False
+        node = 0
+        for char in keyword:
+            node = self._goto[node][char]
+        self._out[node].discard(keyword)
+        self._keywords.discard(keyword)
+        self._dirty = True
+        return True
+    
+    def _link(self):
+        """Recompute failure links and merged outputs breadth-first"""
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            self._all_out[child] = set(self._out[child])
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail if fail != child else 0
+                self._all_out[child] = self._out[child] | self._all_out[self._fail[child]]
+                queue.append(child)
+        self._dirty = False
+    
+    def search(self, text: str) -> Set[str]:
+        """Return every keyword found in text, scanning it once"""
+        if not self._keywords:
+            return set()
+        if self._dirty:
+            self._link()
+        
+        found: Set[str] = set()
+        text = text.casefold()
+        goto, fail, all_out = self._goto, self._fail, self._all_out
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if all_out[node]:
+                after_ok = i + 1 == len(text) or not text[i + 1].isalnum()
+                if not after_ok:
+                    continue
+                for keyword in all_out[node]:
+                    start = i - len(keyword) + 1
+                    if start == 0 or not text[start - 1].isalnum():
+                        found.add(keyword)
+        return found
+
+
+class Watchlist:
+    """Owner-maintained keywords and regexes, persisted in Settings.
+    
+    Entries written as /pattern/ are regular expressions, everything else
+    is a keyword. Keywords go into one Aho-Corasick automaton, so a message
+    is scanned once for all of them. Each regex is compiled and searched on
+    its own: joining them into one alternation would renumber their groups
+    (breaking backreferences) and reject inline flags that are only valid
+    at the start of a pattern.
+    """
+    
+    def __init__(self, settings):
+        self.settings = settings
+        self._automaton = AhoCorasick()
+        self._patterns: Dict[str, re.Pattern] = {}
+        
+        stored = settings.get("watchlist") or {}
+        for keyword in stored.get("keywords", []):
+            self._automaton.add(keyword)
+        for pattern in stored.get("patterns", []):
+            try:
+                self._patterns[pattern] = self._compile(pattern)
+            except re.error as e:
+                logger.error("Ignoring invalid watch pattern %r: %s", pattern, e)
+    
+    def __len__(self) -> int:
+        return len(self._automaton) + len(self._patterns)
+    
+    @staticmethod
+    def _parse(entry: str):
+        """Split an entry into ("pattern", regex) or ("keyword", text)"""
+        entry = entry.strip()
+        if len(entry) > 2 and entry.startswith("/") and entry.endswith("/"):
+            return "pattern", entry[1:-1]
+        return "keyword", entry.casefold()
+    
+    @staticmethod
+    def _compile(pattern: str) -> re.Pattern:
+        return re.compile(pattern, re.IGNORECASE)
+    
+    def _save(self):
+        self.settings.set("watchlist", {
+            "keywords": sorted(self._automaton._keywords),
+            "patterns": list(self._patterns),
+        })
+    
+    def add(self, entry: str) -> bool:
+        """Add a keyword or /regex/; raises re.error for a bad regex"""
+        kind, value = self._parse(entry)
+        if not value:
+            return False
+        if kind == "pattern":
+            regex = self._compile(value)
+            if value in self._patterns:
+                return False
+            self._patterns[value] = regex
+        else:
+            if value in self._automaton._keywords:
+                return False
+            self._automaton.add(value)
+        self._save()
+        return True
+    
+    def remove(self, entry: str) -> bool:
+        """Remove a keyword or /regex/"""
+        kind, value = self._parse(entry)
+        if kind == "pattern":
+            if value not in self._patterns:
+                return False
+            del self._patterns[value]
+        elif not self._automaton.remove(value):
+            return False
+        self._save()
+        return True
+    
+    def entries(self) -> List[str]:
+        """All entries in display form"""
+        return sorted(self._automaton._keywords) + [f"/{pattern}/" for pattern in self._patterns]
+    
+    def match(self, text: Optional[str]) -> List[str]:
+        """Return the entries that match text"""
+        if not text or not len(self):
+            return []
+        hits = sorted(self._automaton.search(text))
+        hits += [f"/{pattern}/" for pattern, regex in self._patterns.items() if regex.search(text)]
+        return hits